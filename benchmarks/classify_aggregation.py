@@ -0,0 +1,42 @@
+"""Compare the old pandas aggregation in Classifier.classify with NumPy
+
+Run with: python benchmarks/classify_aggregation.py
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from thought_log.nlp.classifier import top_k
+
+LABELS = {i: label for i, label in enumerate(["sad", "joyful", "angry", "calm"])}
+
+
+def with_pandas(scores, k):
+    records = [
+        {"label": LABELS[i], "score": float(row[i])}
+        for row in scores
+        for i in range(len(row))
+    ]
+    mean = pd.DataFrame.from_records(records).groupby("label").mean()
+    result = [{"label": r[0], "score": r[1].score} for r in mean.iterrows()]
+    return sorted(result, key=lambda r: r["score"], reverse=True)[:k]
+
+
+def with_numpy(scores, k):
+    mean = scores.mean(axis=0)
+    return [{"label": LABELS[i], "score": float(mean[i])} for i in top_k(mean, k)]
+
+
+def main(number: int = 2000):
+    rng = np.random.default_rng(0)
+
+    for num_chunks in (1, 4, 32):
+        scores = rng.dirichlet(np.ones(len(LABELS)), size=num_chunks)
+        for name, func in (("pandas", with_pandas), ("numpy", with_numpy)):
+            seconds = timeit.timeit(lambda: func(scores, 2), number=number)
+            print(f"{num_chunks:>3} chunks  {name:<6} {seconds / number * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
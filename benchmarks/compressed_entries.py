@@ -0,0 +1,62 @@
+"""Compare plain and compressed entry files for a full-corpus read
+
+Prints the size on disk and the time to read every entry from page cache,
+plus an estimate for a slow disk: read time plus bytes over bandwidth.
+
+Run with: python benchmarks/compressed_entries.py
+"""
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from thought_log.utils import COMPRESSIONS, read_json, write_json
+
+WORDS = "the a i was today felt really tired happy work home walk friend".split()
+# MB/s of a network share or spinning disk
+BANDWIDTHS = (20, 100)
+
+
+def make_entry(i: int, rng: random.Random):
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 400)))
+    return {
+        "id": 20200101000000 + i,
+        "uuid": f"{i:032X}",
+        "_hash": f"{i:032x}",
+        "date": "2020-01-01T00:00:00",
+        "text": text,
+        "metadata": {"weather": None},
+        "analysis": {"emotion": [{"label": "joyful", "score": 0.9}]},
+    }
+
+
+def main(num_entries: int = 2000):
+    rng = random.Random(0)
+    entries = [make_entry(i, rng) for i in range(num_entries)]
+    header = f"{'codec':<6} {'MB':>6} {'write s':>8} {'read s':>7}"
+    print(header + "".join(f" {f'@{bw}MB/s':>9}" for bw in BANDWIDTHS))
+
+    for compression in (None, *COMPRESSIONS):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [Path(tmp, f"{e['id']}.json") for e in entries]
+
+            start = time.perf_counter()
+            for entry, path in zip(entries, paths):
+                write_json(entry, path, compression=compression)
+            write_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for path in paths:
+                read_json(path)
+            read_seconds = time.perf_counter() - start
+
+            mb = sum(path.stat().st_size for path in paths) / 2**20
+
+        row = f"{compression or 'plain':<6} {mb:6.2f} {write_seconds:8.2f} "
+        row += f"{read_seconds:7.2f}"
+        row += "".join(f" {read_seconds + mb / bw:9.2f}" for bw in BANDWIDTHS)
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
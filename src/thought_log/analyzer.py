@@ -1,88 +1,373 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from typing import Dict, List
-from thought_log.entry_handler import load_entries
+
+from thought_log.entry_handler import entry_filepaths, load_entry
 from tqdm.auto import tqdm
 
 from thought_log.config import (
-    CLASSIFIER_NAMES,
+    ANALYZE_CORPUS_SIZE,
+    ANALYZE_MEMORY_BUDGET,
+    STORAGE_COMPRESSION,
     STORAGE_DIR,
+    STORAGE_ENGINE,
 )
+from thought_log.manifest import Manifest
+from thought_log.segments import get_store
 from thought_log.utils import (
+    batched,
     list_entries,
     write_json,
 )
 
 
 DEFAULT_CLASSIFIERS = ["emotion", "sentiment", "context"]
+# Fresh interpreters, so workers never inherit the parent's torch threads
+WORKER_START_METHOD = "spawn"
+
+_worker_manifest = None
 
 
 def get_classifiers(classifier_names: List[str] = None) -> Dict:
-    from thought_log.nlp.classifier import Classifier
+    """Get classifiers from the shared registry so models load only once"""
+    from thought_log.nlp import registry
 
     if not classifier_names:
         classifier_names = DEFAULT_CLASSIFIERS
 
-    classifiers = {}
-
-    for name in classifier_names:
-        classifier_path = CLASSIFIER_NAMES[name]
-        classifiers[name] = Classifier(model=classifier_path, tokenizer=classifier_path)
-
-    return classifiers
+    return registry.get_classifiers(classifier_names)
 
 
 def analyze_entries(
     reverse: bool = True,
     num_entries: int = -1,
     classifier_names: List[str] = None,
+    batch_size: int = None,
+    corpus_size: int = ANALYZE_CORPUS_SIZE,
+    memory_budget: float = ANALYZE_MEMORY_BUDGET,
+    workers: int = 1,
+    since: datetime = None,
+    until: datetime = None,
 ):
+    """Analyze new, edited or outdated entries, corpus_size entry ids at a time
+
+    The manifest records which text and model revision produced each result,
+    so unchanged files are not even read. With a memory_budget (MB),
+    classifiers are split into passes whose models fit in it. Each pass walks
+    every entry, then unloads its models. With more than one worker, groups
+    of entries are spread over a process pool.
+    """
+    from thought_log.nlp import registry
+
     if not classifier_names:
         classifier_names = DEFAULT_CLASSIFIERS
 
-    classifiers = get_classifiers(classifier_names)
+    if workers > 1 and STORAGE_ENGINE == "segments":
+        # Workers would append to the same segment
+        raise ValueError("Analyzing with workers needs the files storage engine")
+
+    zkids = list_entries(
+        STORAGE_DIR,
+        reverse=reverse,
+        num_entries=num_entries,
+        since=since,
+        until=until,
+    )
+    groups = list(batched(zkids, corpus_size))
+    passes = plan_passes(classifier_names, memory_budget)
+    manifest = Manifest.for_storage(STORAGE_DIR)
+
+    seen, updated = set(), set()
+
+    for names in passes:
+        fingerprints = {name: registry.model_fingerprint(name) for name in names}
+
+        with tqdm(total=len(zkids), desc=", ".join(names)) as progress:
+            if workers > 1:
+                results = analyze_in_workers(
+                    groups, names, fingerprints, batch_size, workers
+                )
+            else:
+                results = (
+                    analyze_group(group, names, fingerprints, manifest, batch_size)
+                    for group in groups
+                )
+
+            for group, group_seen, group_updated, records in results:
+                seen.update(group_seen)
+                updated.update(group_updated)
+                # Saved after every group so an interrupted run resumes here
+                manifest.records.update(records)
+                manifest.save()
+                progress.update(len(group))
+
+        if len(passes) > 1:
+            registry.unload(names)
+
+    print(f"Skipped {len(seen - updated)}")
+
+
+def analyze_group(
+    zkids: List[int],
+    classifier_names: List[str],
+    fingerprints: Dict[str, str],
+    manifest: Manifest,
+    batch_size: int = None,
+):
+    """Analyze the entries of some zkids that need it and write the changes
+
+    Returns the zkids, the entries seen and written (files, or uuids in the
+    segment store), and their manifest records.
+    """
+    if STORAGE_ENGINE == "segments":
+        return analyze_segment_group(
+            zkids, classifier_names, fingerprints, manifest, batch_size
+        )
+
+    filepaths = [f for zkid in zkids for f in entry_filepaths(zkid)]
+    entries = [
+        load_entry(f) for f in filepaths if not manifest.is_current(f, fingerprints)
+    ]
+    before = {}
+    updated = []
 
-    zkids = list_entries(STORAGE_DIR, reverse=reverse, num_entries=num_entries)
+    for entry, filepath in entries:
+        analysis = entry.setdefault("analysis", {})
+        before[filepath] = dict(analysis)
+        for name in manifest.stale(entry, filepath, fingerprints):
+            analysis.pop(name, None)
 
-    skipped = 0
+    analyze_pending([entry for entry, _ in entries], classifier_names, batch_size)
 
-    for zkid in tqdm(zkids):
-        entries = load_entries(zkid)
+    for entry, filepath in entries:
+        if entry["analysis"] != before[filepath]:
+            write_json(entry, filepath, compression=STORAGE_COMPRESSION)
+            updated.append(filepath)
+        manifest.record(entry, filepath, fingerprints)
 
-        for entry, filepath in entries:
-            entry["analysis"] = analyze_entry(
-                entry, classifier_names=classifier_names, classifiers=classifiers
+    records = {f.name: manifest.records[f.name] for f in filepaths}
+    return zkids, filepaths, updated, records
+
+
+def analyze_segment_group(
+    zkids: List[int],
+    classifier_names: List[str],
+    fingerprints: Dict[str, str],
+    manifest: Manifest,
+    batch_size: int = None,
+):
+    """analyze_group for the segment store
+
+    The group is read in segment order and changed entries are appended as
+    new versions in one batch.
+    """
+    store = get_store(STORAGE_DIR)
+    entries = store.read_many(zkids)
+    uuids = [entry["uuid"] for entry in entries]
+    before = {}
+
+    for entry in entries:
+        analysis = entry.setdefault("analysis", {})
+        before[entry["uuid"]] = dict(analysis)
+        for name in manifest.stale(entry, entry["uuid"], fingerprints):
+            analysis.pop(name, None)
+
+    analyze_pending(entries, classifier_names, batch_size)
+
+    changed = [e for e in entries if e["analysis"] != before[e["uuid"]]]
+    store.put_many(changed)
+
+    for entry in entries:
+        manifest.record_analysis(entry, entry["uuid"], fingerprints)
+
+    records = {uuid: manifest.records[uuid] for uuid in uuids}
+    return zkids, uuids, [entry["uuid"] for entry in changed], records
+
+
+def analyze_pending(entries: List[Dict], classifier_names: List[str], batch_size):
+    """Run analyze_corpus if any entry is missing one of the classifiers"""
+    pending = [n for e in entries for n in classifier_names if n not in e["analysis"]]
+
+    if pending:
+        analyze_corpus(
+            entries,
+            classifier_names=classifier_names,
+            classifiers=get_classifiers(classifier_names),
+            batch_size=batch_size,
+        )
+
+
+def analyze_in_workers(
+    groups: List[List[int]],
+    classifier_names: List[str],
+    fingerprints: Dict[str, str],
+    batch_size: int = None,
+    workers: int = 2,
+):
+    """Run analyze_group over a process pool, yielding results as they finish
+
+    Each worker loads the models once. Entry files are split by zkid, so
+    workers never write the same file; only the parent saves the manifest.
+    """
+    context = multiprocessing.get_context(WORKER_START_METHOD)
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(num_threads,),
+    ) as executor:
+        futures = [
+            executor.submit(
+                analyze_group_in_worker,
+                group,
+                classifier_names,
+                fingerprints,
+                batch_size,
             )
+            for group in groups
+        ]
+        for future in as_completed(futures):
+            yield future.result()
 
-            write_json(entry, filepath)
 
-    print(f"Skipped {skipped}")
+def init_worker(num_threads: int):
+    """Split the cores between workers instead of every worker using all"""
+    import torch
 
+    global _worker_manifest
 
-def analyze_entry(
-    entry: Dict,
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    torch.set_num_threads(num_threads)
+    # Each pass gets a new pool, and within a pass a worker's files are its own
+    _worker_manifest = Manifest.for_storage(STORAGE_DIR)
+
+
+def analyze_group_in_worker(zkids, classifier_names, fingerprints, batch_size):
+    return analyze_group(
+        zkids, classifier_names, fingerprints, _worker_manifest, batch_size
+    )
+
+
+def plan_passes(
+    classifier_names: List[str], memory_budget: float = None
+) -> List[List[str]]:
+    """Group classifiers into passes whose models fit in memory_budget MB
+
+    Models whose size is unknown get a pass of their own.
+    """
+    from thought_log.nlp import registry
+
+    if memory_budget is None:
+        return [list(classifier_names)]
+
+    passes = []
+    used = 0
+
+    for name in classifier_names:
+        size = registry.model_size(name)
+        fits = size is not None and used + size <= memory_budget
+
+        if passes and fits:
+            passes[-1].append(name)
+            used += size
+        else:
+            passes.append([name])
+            used = memory_budget if size is None else size
+
+    return passes
+
+
+def analyze_corpus(
+    entries: List[Dict],
     classifier_names: List[str] = None,
     classifiers: Dict = None,
-) -> Dict:
+    batch_size: int = None,
+) -> List[Dict]:
+    """Analyze many entries together, one classifier pass over all of them
+
+    Returns the entries that were given a new analysis.
+    """
     if not classifier_names:
         classifier_names = DEFAULT_CLASSIFIERS
 
     if not classifiers:
         classifiers = get_classifiers(classifier_names)
 
-    analysis = entry.get("analysis", {})
+    updated = {}
+
+    for names in group_by_chunking(classifier_names, classifiers):
+        pending = {
+            name: [e for e in entries if name not in e.get("analysis", {})]
+            for name in names
+        }
+        chunked = None
+
+        if len(names) > 1:
+            # Chunked once, then fed to every classifier in the group
+            texts = {id(e): e["text"] for name in names for e in pending[name]}
+            chunks = classifiers[names[0]].chunk_many(list(texts.values()))
+            chunked = dict(zip(texts, chunks))
+
+        for name in names:
+            if not pending[name]:
+                continue
+
+            if chunked is None:
+                results = classifiers[name].classify_many(
+                    [e["text"] for e in pending[name]], batch_size=batch_size
+                )
+            else:
+                results = classifiers[name].classify_chunked(
+                    [chunked[id(e)] for e in pending[name]], batch_size=batch_size
+                )
+
+            for entry, result in zip(pending[name], results):
+                entry.setdefault("analysis", {})[name] = result
+                updated[id(entry)] = entry
+
+    return list(updated.values())
+
+
+def group_by_chunking(classifier_names: List[str], classifiers: Dict) -> List[List]:
+    """Group classifiers that split text into the same chunks"""
+    groups = {}
 
     for name in classifier_names:
-        if name not in analysis:
-            analysis[name] = classifiers[name].classify(entry["text"])
+        groups.setdefault(classifiers[name].chunk_key, []).append(name)
+
+    return list(groups.values())
+
+
+def analyze_entry(
+    entry: Dict,
+    classifier_names: List[str] = None,
+    classifiers: Dict = None,
+) -> Dict:
+    if not classifier_names:
+        classifier_names = DEFAULT_CLASSIFIERS
 
-    return analysis
+    if not classifiers:
+        classifiers = get_classifiers(classifier_names)
+
+    analyze_corpus([entry], classifier_names=classifier_names, classifiers=classifiers)
+    return entry["analysis"]
 
 
 def analyze_text(text: str, num_labels: int = 1, include_score: bool = False):
     analysis = {}
     classifiers = get_classifiers()
 
-    for name, classifier in classifiers.items():
-        result = classifier.classify(text, k=num_labels, include_score=include_score)
-        analysis[name] = result[:1] if name == "sentiment" else result
+    for names in group_by_chunking(list(classifiers), classifiers):
+        text_chunks = classifiers[names[0]].chunk_many([text])
+
+        for name in names:
+            result = classifiers[name].classify_chunked(
+                text_chunks, k=num_labels, include_score=include_score
+            )[0]
+            analysis[name] = result[:1] if name == "sentiment" else result
 
-    return analysis
+    return {name: analysis[name] for name in classifiers}
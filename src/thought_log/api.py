@@ -1,15 +1,33 @@
 import json
+import os
+import threading
 
-from bottle import route, run, request, response
+from bottle import HTTPResponse, abort, route, run, request, response
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
-from thought_log.config import DEBUG
-from thought_log.analyzer import analyze_text
-from thought_log.models import Note, Notebook
+from thought_log.config import (
+    API_EMBED_LIMIT,
+    API_EXPORT_BATCH_SIZE,
+    API_MAX_PAGE_SIZE,
+    API_PAGE_SIZE,
+    DEBUG,
+)
+from thought_log.analyzer import DEFAULT_CLASSIFIERS, analyze_text
+from thought_log.nlp import registry
+from thought_log.models import Note, Notebook, ensure_indexes
 
 
 RESOURCES = {"notes": Note, "notebooks": Notebook}
 
 
+def get_embed_params():
+    """Read _embed, _embed_limit and _embed_fields from the query string"""
+    embed = request.query.get("_embed")
+    limit = int(request.query.get("_embed_limit", API_EMBED_LIMIT))
+    fields = request.query.get("_embed_fields")
+    return embed, limit, fields.split(",") if fields else None
+
+
 @route("/analyze", method="POST")
 def analyze():
     data = request.json
@@ -20,25 +38,99 @@ def analyze():
     return analysis
 
 
+@route("/ready", method="GET")
+def ready():
+    if not registry.is_ready():
+        return HTTPResponse({"ready": False}, status=503)
+    return {"ready": True}
+
+
 @route("/<name>", method="GET")
 def get_record_list(name):
+    """List records a page at a time
+
+    Query params: limit, after (cursor from X-Next-Cursor), sort (id or
+    created, "-" prefix for descending), fields (comma-separated) and
+    _embed/_embed_limit/_embed_fields for children.
+    """
+    resource = RESOURCES[name]
+    fields = request.query.get("fields")
+
+    try:
+        limit = min(int(request.query.get("limit", API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+        records, next_cursor = resource.find_page(
+            limit=max(limit, 1),
+            after=request.query.get("after"),
+            sort=request.query.get("sort", "id"),
+            fields=fields.split(",") if fields else None,
+        )
+        embed, embed_limit, embed_fields = get_embed_params()
+        if embed:
+            resource.embed_children(records, embed, embed_limit, embed_fields)
+    except ValueError as e:
+        abort(400, str(e))
+
     response.content_type = "application/json"
-    return json.dumps(list(map(lambda n: n.to_dict(), RESOURCES[name].find())))
+    if next_cursor:
+        response.set_header("X-Next-Cursor", next_cursor)
+
+    return json.dumps(list(map(lambda n: n.to_dict(embed=embed), records)))
+
+
+@route("/<name>/export", method="GET")
+def export_record_list(name):
+    """Stream every record as newline-delimited JSON"""
+    fields = request.query.get("fields")
+
+    try:
+        records = RESOURCES[name].stream(
+            fields=fields.split(",") if fields else None,
+            batch_size=API_EXPORT_BATCH_SIZE,
+        )
+        # Pull the first record now so bad params still return a 400
+        first = next(records, None)
+    except ValueError as e:
+        abort(400, str(e))
+
+    response.content_type = "application/x-ndjson"
+
+    def generate():
+        if first is None:
+            return
+        yield first.to_json() + "\n"
+        for record in records:
+            yield record.to_json() + "\n"
+
+    return generate()
 
 
 @route("/<name>", method="POST")
 def post_record(name):
     request_data = request.json
     resource = RESOURCES[name]
-    resource.upsert(request_data)
-    return resource.last().to_dict()
+
+    if isinstance(request_data, list):
+        response.content_type = "application/json"
+        return json.dumps(resource.upsert(request_data))
+
+    try:
+        return resource.save_returning(request_data).to_dict()
+    except DuplicateKeyError:
+        abort(409, f"A {name[:-1]} with that id already exists")
 
 
 @route("/<name>/<id:int>", method="GET")
 def get_record(name, id):
     resource = RESOURCES[name]
     record = resource.find_one({"id": id})
-    embed = request.query.get("_embed", None)
+
+    try:
+        embed, embed_limit, embed_fields = get_embed_params()
+        if embed:
+            resource.embed_children([record], embed, embed_limit, embed_fields)
+    except ValueError as e:
+        abort(400, str(e))
+
     return record.to_dict(embed=embed)
 
 
@@ -48,10 +140,48 @@ def update_note(name, id):
     # Set id in request_data so we can find it
     request_data["id"] = id
     resource = RESOURCES[name]
-    resource.upsert(request_data)
-    record = resource.find_one({"id": id})
+    record = resource.update(request_data)
+
+    if record is None:
+        abort(404, f"No {name} with id {id}")
+
     return record.to_dict()
 
 
-def serve(host: str = "localhost", port: int = 8080, debug: bool = DEBUG):
+def ensure_indexes_safely():
+    """Create indexes, reporting failures instead of stopping the server"""
+    try:
+        ensure_indexes()
+    except DuplicateKeyError as e:
+        print(
+            "Could not create a unique index because of duplicate ids. Remove "
+            f"the duplicates, then run `tl db ensure-indexes`: {e}"
+        )
+    except PyMongoError as e:
+        print(
+            f"Could not create indexes: {e}. Run `tl db ensure-indexes` once the "
+            "database is reachable"
+        )
+
+
+def serve(
+    host: str = "localhost",
+    port: int = 8080,
+    debug: bool = DEBUG,
+    preload: bool = True,
+    indexes: bool = True,
+):
+    # With the reloader on, only the child process actually serves requests
+    is_server_process = not debug or os.environ.get("BOTTLE_CHILD")
+
+    if indexes and is_server_process:
+        # In the background so an unreachable database doesn't hold up startup
+        threading.Thread(target=ensure_indexes_safely, daemon=True).start()
+
+    if preload and is_server_process:
+        # Warm the models in the background; /ready reports 503 until done
+        threading.Thread(
+            target=registry.preload, args=(DEFAULT_CLASSIFIERS,), daemon=True
+        ).start()
+
     run(host=host, port=port, debug=debug, reloader=debug)
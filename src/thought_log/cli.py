@@ -2,10 +2,10 @@ from pathlib import Path
 
 import click
 
-from thought_log.analyzer import DEFAULT_CLASSIFIERS
-from thought_log.api import serve
-from thought_log.config import INCLUDE_WEATHER, DEBUG
-from thought_log.utils import unset_config
+from thought_log.config import ANALYZE_MEMORY_BUDGET, INCLUDE_WEATHER, DEBUG
+from thought_log.utils import COMPRESSIONS, unset_config
+
+DATE = click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"])
 
 
 @click.group()
@@ -23,13 +23,19 @@ def cli():
     help="Number of entries to show, Set to -1 to show all",
 )
 @click.option("--show-id/--no-show-id", "-i")
-def show(oldest, num_entries, show_id):
+@click.option("--since", type=DATE, help="Entries from this date on")
+@click.option("--until", type=DATE, help="Entries up to and including this date")
+def show(oldest, num_entries, show_id, since, until):
     """Show entries"""
     from thought_log.entry_handler import show_entries
 
     try:
         entries = show_entries(
-            reverse=not oldest, num_entries=num_entries, show_id=show_id
+            reverse=not oldest,
+            num_entries=num_entries,
+            show_id=show_id,
+            since=since,
+            until=until,
         )
         click.echo_via_pager(entries)
     except ValueError as e:
@@ -44,14 +50,43 @@ def show(oldest, num_entries, show_id):
     type=click.Choice(["emotion", "context", "sentiment"]),
     default=None,
 )
-def analyze(update):
+@click.option(
+    "--batch-size",
+    "-b",
+    type=int,
+    default=None,
+    help="Chunks per model call, defaults to classifier_batch_size",
+)
+@click.option(
+    "--memory-budget",
+    "-m",
+    type=float,
+    default=ANALYZE_MEMORY_BUDGET,
+    help="MB of models to keep loaded at once; 0 loads one model per pass",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Worker processes, each loading its own copy of the models",
+)
+@click.option("--since", type=DATE, help="Entries from this date on")
+@click.option("--until", type=DATE, help="Entries up to and including this date")
+def analyze(update, batch_size, memory_budget, workers, since, until):
     """Assign emotion classifications"""
-    from thought_log.analyzer import analyze_entries
+    from thought_log.analyzer import DEFAULT_CLASSIFIERS, analyze_entries
 
-    if not update:
-        update = DEFAULT_CLASSIFIERS
+    classifier_names = [update] if update else DEFAULT_CLASSIFIERS
 
-    analyze_entries(classifier_names=update)
+    analyze_entries(
+        classifier_names=classifier_names,
+        batch_size=batch_size,
+        memory_budget=memory_budget,
+        workers=workers,
+        since=since,
+        until=until,
+    )
 
 
 @cli.command()
@@ -120,11 +155,49 @@ def handle_config(action, key, value):
 
 
 @cli.command()
-def download():
+@click.option("--onnx/--no-onnx", default=False, help="Also export to ONNX")
+def download(onnx):
     """Download models"""
     from thought_log.utils import download_models
 
-    download_models()
+    model_paths = download_models()
+
+    if onnx:
+        from thought_log.nlp.onnx_backend import export_onnx
+
+        # The core model is the chatbot, the rest are classifiers
+        model_paths.pop("core_path", None)
+
+        for name, model in model_paths.items():
+            click.echo(f"{name}: {export_onnx(model)}")
+
+
+@cli.command(name="precision-report")
+@click.option(
+    "--classifier",
+    "-c",
+    "classifier_names",
+    multiple=True,
+    type=click.Choice(["emotion", "context", "sentiment"]),
+)
+@click.option("--num_entries", "-n", default=200, help="Newest entries to compare on")
+def precision_report(classifier_names, num_entries):
+    """Compare int8 quantized classifiers with fp32 on stored entries"""
+    from thought_log.analyzer import DEFAULT_CLASSIFIERS
+    from thought_log.config import CLASSIFIER_NAMES
+    from thought_log.entry_handler import load_texts
+    from thought_log.nlp.quantization import drift_report
+
+    texts = load_texts(num_entries=num_entries)
+
+    for name in classifier_names or DEFAULT_CLASSIFIERS:
+        report = drift_report(CLASSIFIER_NAMES[name], texts)
+        click.echo(
+            f"{name}: {report['agreement']:.1%} same label, "
+            f"score drift mean {report['mean_score_drift']:.4f} "
+            f"max {report['max_score_drift']:.4f}, "
+            f"{report['speedup']:.1f}x faster on {report['texts']} entries"
+        )
 
 
 @cli.command()
@@ -149,7 +222,140 @@ def interact(
 @click.option("--host", "-H", default="localhost")
 @click.option("--port", "-P", default=8080)
 @click.option("--debug/--no-debug", "-d", default=DEBUG)
-def api(host, port, debug):
+@click.option("--preload/--no-preload", default=True, help="Load models on startup")
+@click.option("--indexes/--no-indexes", default=True, help="Ensure indexes on startup")
+def api(host, port, debug, preload, indexes):
     """Serve API"""
+    from thought_log.api import serve
+
     print(f"DEBUG: {debug}")
-    serve(host=host, port=port, debug=debug)
+    serve(host=host, port=port, debug=debug, preload=preload, indexes=indexes)
+
+
+@cli.group()
+def db():
+    """Manage the database"""
+    pass
+
+
+@db.command(name="seed-counters")
+def seed_counters():
+    """Seed autoincrement counters from existing max ids"""
+    from thought_log.models import MODELS
+    from thought_log.storage import storage
+
+    for name, model in MODELS.items():
+        counter = storage.seed_counter(model.COLLECTION_NAME, model.AUTOINCREMENT)
+        click.echo(f"{name}: {counter['seq']}")
+
+
+@db.command(name="ensure-indexes")
+@click.option("--check/--no-check", default=True, help="Explain indexed queries")
+def handle_ensure_indexes(check):
+    """Create indexes declared on the models"""
+    from pymongo.errors import DuplicateKeyError
+
+    from thought_log.models import MODELS, ensure_indexes
+    from thought_log.storage import storage
+
+    try:
+        created_indexes = ensure_indexes()
+    except DuplicateKeyError as e:
+        raise click.ClickException(
+            f"Remove documents with duplicate ids before creating unique indexes: {e}"
+        )
+
+    for name, created in created_indexes.items():
+        click.echo(f"{name}: {', '.join(created)}")
+
+    if not check:
+        return
+
+    for name, model in MODELS.items():
+        for keys, _ in model.INDEXES:
+            # A compound index serves queries on its first field
+            field = keys if isinstance(keys, str) else keys[0][0]
+            stages = storage.query_plan(model.COLLECTION_NAME, {field: None})
+            click.echo(f"{name}.{field}: {' <- '.join(stages)}")
+
+
+@cli.group(name="storage")
+def storage_group():
+    """Manage how entries are stored in storage_dir"""
+    pass
+
+
+@storage_group.command()
+def reindex():
+    """Rebuild the hash/uuid/zkid index from the entry files or segments"""
+    from thought_log.config import STORAGE_DIR, STORAGE_ENGINE
+    from thought_log.entry_index import get_index
+    from thought_log.segments import get_store
+
+    if STORAGE_ENGINE == "segments":
+        click.echo(f"Indexed {get_store(STORAGE_DIR).rebuild()} entries")
+    else:
+        click.echo(f"Indexed {get_index(STORAGE_DIR).rebuild()} entries")
+
+
+@storage_group.command()
+@click.option("--layout", "-l", type=click.Choice(["flat", "monthly"]), required=True)
+def migrate(layout):
+    """Move entry files into a storage layout; safe to rerun if interrupted"""
+    from thought_log.config import STORAGE_DIR
+    from thought_log.layout import migrate as migrate_layout
+    from thought_log.utils import set_config
+
+    moved = migrate_layout(STORAGE_DIR, layout)
+    # Only once every file is in place, so new imports follow the layout
+    set_config("storage_layout", layout)
+    click.echo(f"Moved {moved} entries to the {layout} layout")
+
+
+@storage_group.command()
+@click.option(
+    "--compression",
+    "-c",
+    type=click.Choice(["none", *COMPRESSIONS]),
+    required=True,
+)
+def compress(compression):
+    """Rewrite entry files compressed (or plain with none); safe to rerun"""
+    from thought_log.config import STORAGE_DIR
+    from thought_log.layout import recompress
+    from thought_log.utils import set_config, unset_config
+
+    compression = None if compression == "none" else compression
+    rewritten = recompress(STORAGE_DIR, compression)
+
+    if compression:
+        set_config("storage_compression", compression)
+    else:
+        unset_config("storage_compression")
+
+    click.echo(f"Rewrote {rewritten} entries")
+
+
+@storage_group.command()
+def pack():
+    """Copy entry files into segments and switch to the segments engine"""
+    from thought_log.config import STORAGE_DIR
+    from thought_log.segments import pack as pack_entries
+    from thought_log.utils import set_config
+
+    packed = pack_entries(STORAGE_DIR)
+    # Only once every entry is in a segment, so nothing is missed
+    set_config("storage_engine", "segments")
+    click.echo(f"Packed {packed} entries into segments; the entry files are kept")
+
+
+@storage_group.command()
+def compact():
+    """Rewrite segments without superseded entry versions"""
+    from thought_log.config import STORAGE_DIR
+    from thought_log.segments import get_store
+
+    store = get_store(STORAGE_DIR)
+    ratio = store.garbage_ratio()
+    reclaimed = store.compact()
+    click.echo(f"Reclaimed {reclaimed / 2**20:.1f} MB ({ratio:.0%} of segments)")
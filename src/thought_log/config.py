@@ -3,7 +3,7 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 
-from thought_log.utils import load_config
+from thought_log.utils import COMPRESSIONS, app_data_path, load_config
 
 load_dotenv()
 config = load_config()
@@ -13,6 +13,27 @@ DEBUG = os.getenv("DEBUG", False)
 # Environment variables take precedence to allow for runtime overrides
 STORAGE_DIR_NAME = os.getenv("TL_STORAGE_DIR") or config.get("storage_dir", None)
 STORAGE_DIR = Path(STORAGE_DIR_NAME) if STORAGE_DIR_NAME else None
+# "flat" or "monthly" (YYYY/MM/ shards); change it with `tl storage migrate`
+STORAGE_LAYOUT = os.getenv("TL_STORAGE_LAYOUT") or config.get("storage_layout", "flat")
+# "files" (one JSON file per entry) or "segments" (appended to JSONL segment
+# files); switch an existing store with `tl storage pack`
+STORAGE_ENGINE = os.getenv("TL_STORAGE_ENGINE") or config.get("storage_engine", "files")
+# "gzip", "bz2" or "lzma" ("zstd" on Python 3.14+) to compress entry files as
+# they are written; reads detect it, so stores can mix compressed and plain
+STORAGE_COMPRESSION = os.getenv("TL_STORAGE_COMPRESSION") or config.get(
+    "storage_compression"
+)
+if STORAGE_COMPRESSION and STORAGE_COMPRESSION not in COMPRESSIONS:
+    # Warned rather than raised so `tl configure` can still fix it
+    print(
+        f"Ignoring storage_compression {STORAGE_COMPRESSION}, not one of "
+        f"{list(COMPRESSIONS)} on this Python; entry files are written plain"
+    )
+    STORAGE_COMPRESSION = None
+# MB a segment grows to before a new one is started
+SEGMENT_SIZE = int(
+    float(os.getenv("TL_SEGMENT_SIZE") or config.get("segment_size", 64)) * 2**20
+)
 
 CLASSIFIER_NAME = os.getenv("TL_CLASSIFIER_NAME") or config.get("classifier_path")
 SENTIMENT_CLASSIFIER_NAME = os.getenv("TL_SENTIMENT_CLASSIFIER_NAME") or config.get(
@@ -27,6 +48,38 @@ CLASSIFIER_NAMES = {
     "sentiment": SENTIMENT_CLASSIFIER_NAME,
     "context": CLASSIFIER_NAME,
 }
+# "fp32" or "int8" (dynamically quantized, CPU only); a mapping sets it per
+# classifier, e.g. {"emotion": "int8"}
+CLASSIFIER_PRECISION = os.getenv("TL_CLASSIFIER_PRECISION") or config.get(
+    "classifier_precision", "fp32"
+)
+CLASSIFIER_PRECISIONS = {
+    name: CLASSIFIER_PRECISION.get(name, "fp32")
+    if isinstance(CLASSIFIER_PRECISION, dict)
+    else CLASSIFIER_PRECISION
+    for name in CLASSIFIER_NAMES
+}
+# "torch" or "onnx" to run classifiers with ONNX Runtime
+CLASSIFIER_BACKEND = os.getenv("TL_CLASSIFIER_BACKEND") or config.get(
+    "classifier_backend", "torch"
+)
+
+# Tokens shared by consecutive chunks of long texts
+CHUNK_OVERLAP = int(os.getenv("TL_CHUNK_OVERLAP") or config.get("chunk_overlap", 0))
+CLASSIFIER_BATCH_SIZE = int(
+    os.getenv("TL_CLASSIFIER_BATCH_SIZE") or config.get("classifier_batch_size", 8)
+)
+# Entry ids loaded and classified together by `tl analyze`
+ANALYZE_CORPUS_SIZE = int(
+    os.getenv("TL_ANALYZE_CORPUS_SIZE") or config.get("analyze_corpus_size", 256)
+)
+# MB of model weights `tl analyze` may keep loaded at once; unset keeps all
+ANALYZE_MEMORY_BUDGET = os.getenv("TL_ANALYZE_MEMORY_BUDGET") or config.get(
+    "analyze_memory_budget"
+)
+ANALYZE_MEMORY_BUDGET = (
+    float(ANALYZE_MEMORY_BUDGET) if ANALYZE_MEMORY_BUDGET is not None else None
+)
 
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY") or config.get(
     "openweather_api_key"
@@ -38,6 +91,24 @@ INCLUDE_WEATHER = bool(
     os.getenv("INCLUDE_WEATHER") or config.get("include_weather", False)
 )
 
+# API
+API_PAGE_SIZE = int(os.getenv("TL_API_PAGE_SIZE") or config.get("api_page_size", 100))
+API_MAX_PAGE_SIZE = int(
+    os.getenv("TL_API_MAX_PAGE_SIZE") or config.get("api_max_page_size", 1000)
+)
+API_EMBED_LIMIT = int(
+    os.getenv("TL_API_EMBED_LIMIT") or config.get("api_embed_limit", 100)
+)
+API_EXPORT_BATCH_SIZE = int(
+    os.getenv("TL_API_EXPORT_BATCH_SIZE") or config.get("api_export_batch_size", 500)
+)
+
+# Database backend: "mongo" or "sqlite" for an embedded local database
+DB_BACKEND = os.getenv("TL_DB_BACKEND") or config.get("db_backend", "mongo")
+SQLITE_PATH = os.getenv("TL_SQLITE_PATH") or config.get(
+    "sqlite_path", str(app_data_path().joinpath("thought_log.sqlite3"))
+)
+
 # MongoDB
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "thought_log")
 MONGO_ROOT_USERNAME = os.getenv("MONGO_ROOT_USERNAME")
@@ -45,3 +116,15 @@ MONGO_ROOT_PASSWORD = os.getenv("MONGO_ROOT_PASSWORD")
 MONGO_HOST = os.getenv("MONGO_HOST")
 MONGO_CONNECTION_STRING = f"mongodb://{MONGO_ROOT_USERNAME}:{MONGO_ROOT_PASSWORD}@{MONGO_HOST}/{MONGO_DB_NAME}?authSource=admin"
 MONGO_URL = os.getenv("MONGO_URL", MONGO_CONNECTION_STRING)
+MONGO_MAX_POOL_SIZE = int(
+    os.getenv("MONGO_MAX_POOL_SIZE") or config.get("mongo_max_pool_size", 100)
+)
+MONGO_MIN_POOL_SIZE = int(
+    os.getenv("MONGO_MIN_POOL_SIZE") or config.get("mongo_min_pool_size", 0)
+)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS")
+    or config.get("mongo_server_selection_timeout_ms", 30000)
+)
+# Comma-separated, e.g. "zstd,snappy,zlib"
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS") or config.get("mongo_compressors")
@@ -1,7 +1,10 @@
+from datetime import datetime
 from typing import List, Union
 
 from thought_log.importer.filesystem import import_data, prepare_data
-from thought_log.config import DEBUG, STORAGE_DIR
+from thought_log.config import DEBUG, STORAGE_DIR, STORAGE_ENGINE
+from thought_log.entry_index import get_index
+from thought_log.segments import get_store
 from thought_log.utils import (
     display_text,
     hline,
@@ -31,23 +34,50 @@ CONTEXT: {context}
 """
 
 
+def entry_filepaths(zkid: Union[str, int]):
+    return get_index(STORAGE_DIR).filepaths(int(zkid))
+
+
 def load_entries(zkid: Union[str, int]):
-    entry_filepaths = STORAGE_DIR.glob(f"{zkid}.*.*.json")
-    return list(map(load_entry, entry_filepaths))
+    """(entry, location) pairs of a zkid: the file, or the uuid in a segment"""
+    if STORAGE_ENGINE == "segments":
+        return [
+            (entry, entry["uuid"]) for entry in get_store(STORAGE_DIR).find(int(zkid))
+        ]
+
+    return list(map(load_entry, entry_filepaths(zkid)))
+
+
+def load_texts(num_entries: int = -1, reverse: bool = True) -> List[str]:
+    """Texts of the newest (or oldest) stored entries"""
+    zkids = list_entries(STORAGE_DIR, reverse=reverse, num_entries=num_entries)
+    return [entry["text"] for zkid in zkids for entry, _ in load_entries(zkid)]
 
 
 def load_entry(filepath):
     return read_json(filepath), filepath
 
 
-def show_entries(reverse: bool, num_entries: int, show_id: bool):
+def show_entries(
+    reverse: bool,
+    num_entries: int,
+    show_id: bool,
+    since: datetime = None,
+    until: datetime = None,
+):
     if not STORAGE_DIR:
         raise ValueError(
             "Please configure a storage_dir with: "
             "thought-log configure -d path/to/storage_dir"
         )
 
-    zkids = list_entries(STORAGE_DIR, reverse=reverse, num_entries=num_entries)
+    zkids = list_entries(
+        STORAGE_DIR,
+        reverse=reverse,
+        num_entries=num_entries,
+        since=since,
+        until=until,
+    )
 
     additional_attrs = []
     if show_id:
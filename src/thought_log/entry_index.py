@@ -0,0 +1,227 @@
+"""Persistent index of stored entry files by zkid, uuid and hash
+
+Entry files are named {zkid}.{uuid}.{hash}.json, so the index can always be
+rebuilt from the file names alone. It is kept in SQLite next to the entries
+and rebuilt whenever the storage directory changed behind its back. The
+sorted zkids double as the catalog list_entries pages through. Paths are
+stored relative to storage_dir, so both storage layouts resolve the same.
+"""
+import sqlite3
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from thought_log.layout import iter_files, signature
+from thought_log.utils import storage_meta_path
+
+INDEX_NAME = "entries.sqlite3"
+
+_indexes = {}
+
+
+def parse_filename(filepath: Union[str, Path]) -> Optional[Tuple[int, str, str]]:
+    """(zkid, uuid, hash) of an entry file, or None if it is not one"""
+    parts = Path(filepath).name.split(".")
+
+    if len(parts) != 4 or parts[-1] != "json" or not parts[0].isdigit():
+        return None
+
+    return int(parts[0]), parts[1], parts[2]
+
+
+class EntryIndex:
+    def __init__(self, storage_dir: Union[str, Path]):
+        self.storage_dir = Path(storage_dir)
+        self._zkids = None
+        # dir_mtime the cached zkids were loaded at
+        self._zkids_signature = None
+        path = storage_meta_path(storage_dir).joinpath(INDEX_NAME)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                filename TEXT PRIMARY KEY,
+                zkid INTEGER NOT NULL,
+                uuid TEXT,
+                hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS entries_zkid ON entries (zkid);
+            CREATE INDEX IF NOT EXISTS entries_uuid ON entries (uuid);
+            CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+            """
+        )
+
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild if entry files were added or removed by other means"""
+        stored = self.get_meta("dir_mtime")
+
+        if stored != signature(self.storage_dir):
+            self.rebuild()
+        elif stored != self._zkids_signature:
+            # Another process added entries and updated the index itself
+            self._zkids = None
+
+    def mark_synced(self):
+        """Record that the index matches the files as they are now"""
+        with self.connection:
+            self.sync_signature()
+
+    def sync_signature(self):
+        """Store the current signature, keeping the cached zkids if they
+        were current before"""
+        current = signature(self.storage_dir)
+
+        if self.get_meta("dir_mtime") == self._zkids_signature:
+            self._zkids_signature = current
+
+        self.set_meta("dir_mtime", current)
+
+    def relpath(self, filepath: Union[str, Path]) -> str:
+        return Path(filepath).relative_to(self.storage_dir).as_posix()
+
+    def get_meta(self, key: str):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def rebuild(self) -> int:
+        """Reindex every entry file in the storage directory and its shards"""
+        rows = []
+
+        for filepath in iter_files(self.storage_dir):
+            parsed = parse_filename(filepath)
+            if parsed:
+                rows.append((self.relpath(filepath), *parsed))
+
+        with self.connection:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.executemany(
+                "INSERT INTO entries (filename, zkid, uuid, hash) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.set_meta("dir_mtime", signature(self.storage_dir))
+
+        self._zkids = None
+        return len(rows)
+
+    @contextmanager
+    def adding(self, filepath: Union[str, Path]):
+        """Index an entry file as it is written
+
+        The row is only committed if the body of the with block, which writes
+        the file, succeeds.
+        """
+        parsed = parse_filename(filepath)
+
+        if parsed is None:
+            raise ValueError(f"Not an entry file name: {filepath}")
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (filename, zkid, uuid, hash) "
+                "VALUES (?, ?, ?, ?)",
+                (self.relpath(filepath), *parsed),
+            )
+            yield
+            self.sync_signature()
+
+        zkids, zkid = self._zkids, parsed[0]
+        if zkids is not None and self._zkids_signature == self.get_meta("dir_mtime"):
+            i = bisect_left(zkids, zkid)
+            if i == len(zkids) or zkids[i] != zkid:
+                zkids.insert(i, zkid)
+
+    @contextmanager
+    def moving(self, filepath: Union[str, Path], target: Union[str, Path]):
+        """Point the index at an entry file's new place as the body moves it
+
+        The storage signature is left for mark_synced, so a crash midway makes
+        the next open rebuild.
+        """
+        with self.connection:
+            self.connection.execute(
+                "UPDATE entries SET filename = ? WHERE filename = ?",
+                (self.relpath(target), self.relpath(filepath)),
+            )
+            yield
+
+    def all_filepaths(self) -> List[Path]:
+        rows = self.connection.execute(
+            "SELECT filename FROM entries ORDER BY zkid, filename"
+        ).fetchall()
+        return [self.storage_dir.joinpath(row[0]) for row in rows]
+
+    def zkids(self) -> List[int]:
+        """Every stored zkid in order, loaded once and kept in sync by adding"""
+        if self._zkids is None:
+            rows = self.connection.execute(
+                "SELECT DISTINCT zkid FROM entries ORDER BY zkid"
+            ).fetchall()
+            self._zkids = [row[0] for row in rows]
+            self._zkids_signature = self.get_meta("dir_mtime")
+
+        return self._zkids
+
+    def zkid_range(
+        self,
+        since: int = None,
+        until: int = None,
+        reverse: bool = False,
+        limit: int = -1,
+    ) -> List[int]:
+        """Sorted zkids between since and until (inclusive), limit from the
+        newest end when reverse"""
+        self.refresh()
+        zkids = self.zkids()
+        start = 0 if since is None else bisect_left(zkids, since)
+        end = len(zkids) if until is None else bisect_right(zkids, until)
+
+        if limit >= 0:
+            if reverse:
+                start = max(start, end - limit)
+            else:
+                end = min(end, start + limit)
+
+        selected = zkids[start:end]
+        return selected[::-1] if reverse else selected
+
+    def filepaths(self, zkid: int) -> List[Path]:
+        """Entry files of one zkid"""
+        rows = self.connection.execute(
+            "SELECT filename FROM entries WHERE zkid = ? ORDER BY filename", (zkid,)
+        ).fetchall()
+        return [self.storage_dir.joinpath(row[0]) for row in rows]
+
+    def find(self, _hash: str = None, uuid: str = None) -> List[Path]:
+        """Entry files with the given hash or uuid"""
+        rows = self.connection.execute(
+            "SELECT filename FROM entries WHERE hash = ? OR uuid = ?", (_hash, uuid)
+        ).fetchall()
+        return [self.storage_dir.joinpath(row[0]) for row in rows]
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def get_index(storage_dir: Union[str, Path]) -> EntryIndex:
+    """The index of a storage directory, opened once per process"""
+    key = str(Path(storage_dir).resolve())
+
+    if key not in _indexes:
+        _indexes[key] = EntryIndex(storage_dir)
+
+    return _indexes[key]
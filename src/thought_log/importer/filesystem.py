@@ -5,7 +5,16 @@ from typing import Dict, Union
 import frontmatter
 from tqdm.auto import tqdm
 
-from thought_log.config import STORAGE_DIR, DEBUG
+from thought_log.config import (
+    DEBUG,
+    STORAGE_COMPRESSION,
+    STORAGE_DIR,
+    STORAGE_ENGINE,
+    STORAGE_LAYOUT,
+)
+from thought_log.entry_index import get_index
+from thought_log.layout import entry_relpath
+from thought_log.segments import get_store
 from thought_log.utils import get_filetype, read_csv, read_file, zettelkasten_id
 from thought_log.utils.common import find_datetime, make_datetime, sanitize_text
 from thought_log.utils.io import (
@@ -59,7 +68,15 @@ def import_data(data, filename: str = None):
     _hash = data["_hash"]
     uuid = data["uuid"]
 
-    return write_json(data, STORAGE_DIR.joinpath(f"{zkid}.{uuid}.{_hash}.json"))
+    if STORAGE_ENGINE == "segments":
+        return get_store(STORAGE_DIR).put(data)
+
+    filename = f"{zkid}.{uuid}.{_hash}.json"
+    filepath = STORAGE_DIR.joinpath(entry_relpath(filename, STORAGE_LAYOUT))
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    with get_index(STORAGE_DIR).adding(filepath):
+        return write_json(data, filepath, compression=STORAGE_COMPRESSION)
 
 
 def import_from_directory(dirpath: Union[str, Path]):
@@ -127,9 +144,10 @@ def batch_import(entries, metadata):
 
 
 def already_imported(_hash, _uuid) -> bool:
-    found_hashes = _hash and list(STORAGE_DIR.glob(f"*.*.{_hash}.json"))
-    found_uuids = _uuid and list(STORAGE_DIR.glob(f"*.{_uuid}.*.json"))
-    return found_hashes or found_uuids
+    if STORAGE_ENGINE == "segments":
+        return get_store(STORAGE_DIR).exists(_hash=_hash, uuid=_uuid)
+
+    return bool(get_index(STORAGE_DIR).find(_hash=_hash, uuid=_uuid))
 
 
 def prepare_data(
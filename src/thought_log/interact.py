@@ -7,7 +7,7 @@ from transformers import (
     ConversationalPipeline,
 )
 
-from thought_log.nlp.classifier import Classifier
+from thought_log.nlp.registry import load_classifier
 from thought_log.utils import load_config, postprocess_text, preprocess_text
 
 
@@ -113,7 +113,7 @@ def interact(
         config=config,
     )
 
-    classifier = Classifier(classifier_name, tokenizer=classifier_name, device=device)
+    classifier = load_classifier(classifier_name, device=device)
 
     chat_fn = chat_pipeline if pipeline else chat
 
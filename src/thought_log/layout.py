@@ -0,0 +1,116 @@
+"""Where entry files live inside storage_dir
+
+"flat" keeps every {zkid}.{uuid}.{hash}.json in storage_dir itself,
+"monthly" shards them into YYYY/MM/ folders by zkid. Reads go through the
+entry index, so either layout (or a store halfway through a migration)
+resolves the same way.
+"""
+import os
+from pathlib import Path
+from typing import Iterator, Union
+
+LAYOUTS = ["flat", "monthly"]
+
+
+def entry_relpath(filename: str, layout: str = "flat") -> Path:
+    """Path of an entry file relative to storage_dir"""
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown storage layout {layout}, use one of {LAYOUTS}")
+
+    if layout == "flat":
+        return Path(filename)
+
+    return Path(filename[:4], filename[4:6], filename)
+
+
+def shard_dirs(storage_dir: Union[str, Path]) -> Iterator[Path]:
+    """YYYY and YYYY/MM folders of a monthly store"""
+    for year in os.scandir(storage_dir):
+        if not (year.is_dir() and len(year.name) == 4 and year.name.isdigit()):
+            continue
+
+        yield Path(year.path)
+
+        for month in os.scandir(year.path):
+            if month.is_dir() and len(month.name) == 2 and month.name.isdigit():
+                yield Path(month.path)
+
+
+def iter_files(storage_dir: Union[str, Path]) -> Iterator[Path]:
+    """Every file at the top of storage_dir or in one of its shards"""
+    for directory in [Path(storage_dir), *shard_dirs(storage_dir)]:
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                if dir_entry.is_file():
+                    yield Path(dir_entry.path)
+
+
+def signature(storage_dir: Union[str, Path]) -> int:
+    """Latest mtime of the folders entry files live in
+
+    Adding, removing or renaming a file bumps its folder's mtime.
+    """
+    directories = [Path(storage_dir), *shard_dirs(storage_dir)]
+    return max(os.stat(d).st_mtime_ns for d in directories)
+
+
+def migrate(storage_dir: Union[str, Path], layout: str) -> int:
+    """Move every entry file to where layout puts it; returns how many moved
+
+    Each move is a rename recorded in the index as it happens, and files
+    already in place are skipped, so an interrupted migration can simply be
+    run again.
+    """
+    from thought_log.entry_index import get_index
+
+    storage_dir = Path(storage_dir)
+    index = get_index(storage_dir)
+    moved = 0
+
+    for filepath in index.all_filepaths():
+        target = storage_dir.joinpath(entry_relpath(filepath.name, layout))
+
+        if target == filepath:
+            continue
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        with index.moving(filepath, target):
+            os.replace(filepath, target)
+
+        moved += 1
+
+    # Shards left empty by a migration back to flat
+    for directory in sorted(shard_dirs(storage_dir), reverse=True):
+        if not any(directory.iterdir()):
+            directory.rmdir()
+
+    index.mark_synced()
+    return moved
+
+
+def recompress(storage_dir: Union[str, Path], compression: str = None) -> int:
+    """Rewrite entry files with compression (None for plain JSON)
+
+    Files already written that way are skipped and each rewrite replaces the
+    file in one rename, so an interrupted run can simply be run again.
+    Returns how many files were rewritten.
+    """
+    from thought_log.entry_index import get_index
+    from thought_log.utils import detect_compression, read_json, write_json
+
+    index = get_index(storage_dir)
+    rewritten = 0
+
+    for filepath in index.all_filepaths():
+        with open(filepath, "rb") as f:
+            if detect_compression(f.read(6)) == compression:
+                continue
+
+        tmp_path = filepath.with_suffix(".tmp")
+        write_json(read_json(filepath), tmp_path, compression=compression)
+        os.replace(tmp_path, filepath)
+        rewritten += 1
+
+    index.mark_synced()
+    return rewritten
@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+from typing import Dict, List, Union
+
+from thought_log.utils import read_json, storage_meta_path, write_json
+from thought_log.utils.io import generate_hash_from_string
+
+MANIFEST_NAME = "analysis.json"
+
+
+class Manifest:
+    """Content hash and model fingerprints each entry file was analyzed with
+
+    Records are keyed by file name: {"mtime": ns, "size": bytes, "hash": text
+    hash, "models": {name: [text hash, fingerprint]}}. Entries in the segment
+    store are keyed by uuid and have no mtime or size.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.records = read_json(self.path) if self.path.exists() else {}
+
+    @classmethod
+    def for_storage(cls, storage_dir: Union[str, Path]):
+        return cls(storage_meta_path(storage_dir).joinpath(MANIFEST_NAME))
+
+    def is_current(self, filepath: Path, fingerprints: Dict[str, str]) -> bool:
+        """True if the file is unchanged and analyzed by every given model"""
+        record = self.records.get(Path(filepath).name)
+
+        if record is None:
+            return False
+
+        stat = os.stat(filepath)
+        if (record["mtime"], record["size"]) != (stat.st_mtime_ns, stat.st_size):
+            return False
+
+        text_hash = record["hash"]
+        models = record["models"]
+        return all(models.get(n) == [text_hash, fp] for n, fp in fingerprints.items())
+
+    def stale(self, entry: Dict, filepath: Path, fingerprints: Dict) -> List[str]:
+        """Classifier names whose analysis of the entry is missing or outdated"""
+        record = self.records.get(Path(filepath).name, {})
+        models = record.get("models", {})
+        analysis = entry.get("analysis", {})
+        text_hash = generate_hash_from_string(entry["text"])
+
+        return [
+            name
+            for name, fingerprint in fingerprints.items()
+            if name not in analysis
+            # Results from before the manifest existed are kept as they are
+            or models.get(name, [text_hash, fingerprint]) != [text_hash, fingerprint]
+        ]
+
+    def record(self, entry: Dict, filepath: Path, fingerprints: Dict):
+        """Mark the entry as analyzed by the given models at its current text"""
+        stat = os.stat(filepath)
+        record = self.record_analysis(entry, Path(filepath).name, fingerprints)
+        record.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+
+    def record_analysis(self, entry: Dict, key: str, fingerprints: Dict) -> Dict:
+        """Like record, for entries that are not files of their own"""
+        text_hash = generate_hash_from_string(entry["text"])
+        models = self.records.get(key, {}).get("models", {})
+        models.update({n: [text_hash, fp] for n, fp in fingerprints.items()})
+        self.records[key] = {
+            "mtime": None,
+            "size": None,
+            "hash": text_hash,
+            "models": models,
+        }
+        return self.records[key]
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        write_json(self.records, tmp_path)
+        os.replace(tmp_path, self.path)
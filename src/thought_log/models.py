@@ -1,4 +1,7 @@
 from typing import List
+
+from pymongo import ASCENDING
+
 from thought_log.storage import BaseDocument
 
 
@@ -13,6 +16,14 @@ class Note(BaseDocument):
         "created",
         "edited",
     ]
+    INDEXES = [
+        ("id", {"unique": True}),
+        ("uuid", {}),
+        # Covers a notebook's notes in id order, as embeds load them
+        ([("notebook", ASCENDING), ("id", ASCENDING)], {}),
+        # Covers sort=created pages, which break ties on id
+        ([("created", ASCENDING), ("id", ASCENDING)], {}),
+    ]
     AUTOINCREMENT = "id"
     IDENTIFIER_KEYS = ["id"]
 
@@ -31,6 +42,11 @@ class Notebook(BaseDocument):
         "created",
         "edited",
     ]
+    INDEXES = [
+        ("id", {"unique": True}),
+        ("uuid", {}),
+        ([("created", ASCENDING), ("id", ASCENDING)], {}),
+    ]
     AUTOINCREMENT = "id"
     IDENTIFIER_KEYS = ["id"]
     HAS_MANY = Note
@@ -44,3 +60,8 @@ class Notebook(BaseDocument):
 
 
 MODELS = {"notes": Note, "notebooks": Notebook}
+
+
+def ensure_indexes():
+    """Create the declared indexes for every model"""
+    return {name: model.ensure_indexes() for name, model in MODELS.items()}
@@ -1,11 +1,39 @@
+from functools import cached_property
 from typing import Dict, List, Union
 
-import pandas as pd
-from transformers import PreTrainedModel, PreTrainedTokenizer, pipeline
+import numpy as np
+import torch
+from transformers import (
+    AutoConfig,
+    AutoTokenizer,
+    PreTrainedModel,
+    PreTrainedTokenizer,
+    pipeline,
+)
 
-from thought_log.config import CLASSIFIER_NAME
-from thought_log.utils import flatten, sort_list
-from thought_log.nlp.utils import split_chunks, get_device
+from thought_log.config import CHUNK_OVERLAP, CLASSIFIER_BATCH_SIZE, CLASSIFIER_NAME
+from thought_log.utils import batched, flatten
+from thought_log.nlp.onnx_backend import INPUT_NAMES, load_session
+from thought_log.nlp.quantization import PRECISIONS, load_quantized
+from thought_log.nlp.utils import (
+    DEVICES_MAPPING,
+    chunk_budget,
+    chunk_text,
+    chunk_texts,
+    get_device,
+    tokenizer_fingerprint,
+)
+
+
+BACKENDS = ["torch", "onnx"]
+
+
+def top_k(scores: np.ndarray, k: int = 1) -> np.ndarray:
+    """Indices of the k highest scores along the last axis, best first"""
+    k = min(k, scores.shape[-1])
+    indices = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, indices, axis=-1), axis=-1)
+    return np.take_along_axis(indices, order, axis=-1)
 
 
 class Classifier:
@@ -14,45 +42,188 @@ class Classifier:
         model: Union[str, PreTrainedModel] = CLASSIFIER_NAME,
         tokenizer: Union[str, PreTrainedTokenizer] = CLASSIFIER_NAME,
         device: str = None,
+        overlap: int = CHUNK_OVERLAP,
+        batch_size: int = CLASSIFIER_BATCH_SIZE,
+        precision: str = "fp32",
+        backend: str = "torch",
     ) -> None:
-        self.pipe = pipeline(
-            "text-classification",
-            model=model,
-            tokenizer=tokenizer,
-            device=get_device(device),
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, use one of {PRECISIONS}")
+
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, use one of {BACKENDS}")
+
+        self.precision = precision
+        self.backend = backend
+
+        if backend == "onnx":
+            if precision != "fp32" or not isinstance(model, str):
+                raise ValueError("The onnx backend needs an fp32 model path")
+            # Skips loading the PyTorch model entirely
+            self.pipe = None
+            self.session = load_session(model)
+            self.tokenizer = (
+                AutoTokenizer.from_pretrained(tokenizer)
+                if isinstance(tokenizer, str)
+                else tokenizer
+            )
+            self.config = AutoConfig.from_pretrained(model)
+        else:
+            if precision == "int8":
+                if get_device(device) != DEVICES_MAPPING["cpu"]:
+                    raise ValueError("int8 precision only runs on the CPU")
+                model = load_quantized(model)
+
+            self.session = None
+            self.pipe = pipeline(
+                "text-classification",
+                model=model,
+                tokenizer=tokenizer,
+                device=get_device(device),
+            )
+            self.tokenizer = self.pipe.tokenizer
+            self.config = self.pipe.model.config
+            # This is deprecated, but the recommended param top_k=1 is not working
+            self.config.return_all_scores = True
+            # Resize embeddings
+            self.pipe.model.resize_token_embeddings(len(self.tokenizer))
+
+        self.max_length = self.config.max_length
+        self.max_position_embeddings = self.config.max_position_embeddings
+        # Roberta reserves positions for padding, so trust the tokenizer too
+        self.chunk_length = min(
+            self.max_position_embeddings, self.tokenizer.model_max_length
         )
-        # This is deprecated, but the recommended param top_k=1 is not working
-        self.pipe.model.config.return_all_scores = True
-        self.max_length = self.pipe.model.config.max_length
-        self.max_position_embeddings = self.pipe.model.config.max_position_embeddings
+        # Fails early rather than on the first text that needs splitting
+        chunk_budget(self.tokenizer, self.chunk_length, overlap)
+        self.overlap = overlap
+        self.batch_size = batch_size
         # For reference
-        self.label2id = self.pipe.model.config.label2id
-        self.id2label = self.pipe.model.config.id2label
-        # Resize embeddings
-        self.pipe.model.resize_token_embeddings(len(self.pipe.tokenizer))
+        self.label2id = self.config.label2id
+        self.id2label = self.config.id2label
 
     def classify(self, text, k: int = 1, include_score: bool = False):
-        results = self.__call__(text=text, k=k)
-        df = pd.DataFrame.from_records(results)
-        mean = df.groupby("label").mean()
+        return self.classify_many([text], k=k, include_score=include_score)[0]
+
+    def classify_many(
+        self,
+        texts: List[str],
+        k: int = 1,
+        include_score: bool = False,
+        batch_size: int = None,
+    ) -> List:
+        """Classify many texts at once, batching their chunks together"""
+        return self.classify_chunked(
+            self.chunk_many(texts),
+            k=k,
+            include_score=include_score,
+            batch_size=batch_size,
+        )
+
+    def classify_chunked(
+        self,
+        text_chunks: List[List[Dict]],
+        k: int = 1,
+        include_score: bool = False,
+        batch_size: int = None,
+    ) -> List:
+        """Classify texts already split by chunk_many, possibly of another
+        classifier with the same chunk_key"""
+        means = self.score_chunked(text_chunks, batch_size=batch_size)
+        return [self.labels(mean, k=k, include_score=include_score) for mean in means]
 
-        if k == 1:
-            label = mean.score.idxmax()
-            score = mean.score.max()
-            return {"label": label, "score": score} if include_score else label
+    def score_many(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+        """Mean score per label across every chunk of each text (texts x labels)"""
+        return self.score_chunked(self.chunk_many(texts), batch_size=batch_size)
 
-        result = [{"label": r[0], "score": r[1].score} for r in mean.iterrows()]
-        result = sort_list(result, "score", reverse=True)
+    def score_chunked(
+        self, text_chunks: List[List[Dict]], batch_size: int = None
+    ) -> np.ndarray:
+        chunks = flatten(text_chunks)
+        owners = [i for i, c in enumerate(text_chunks) for _ in c]
+
+        scores = self.forward(chunks, batch_size=batch_size)
+        sums = np.zeros((len(text_chunks), scores.shape[1]), dtype=scores.dtype)
+        np.add.at(sums, owners, scores)
+        counts = np.bincount(owners, minlength=len(text_chunks)).clip(min=1)
+        return sums / counts[:, None]
+
+    def chunk_many(self, texts: List[str]) -> List[List[Dict]]:
+        return chunk_texts(
+            self.tokenizer,
+            texts,
+            max_length=self.chunk_length,
+            overlap=self.overlap,
+        )
+
+    @cached_property
+    def chunk_key(self):
+        """Classifiers with equal keys split any text into identical chunks"""
+        return tokenizer_fingerprint(self.tokenizer), self.chunk_length, self.overlap
+
+    def labels(self, scores: np.ndarray, k: int = 1, include_score: bool = False):
+        """Top k labels for a row of scores: one label if k == 1, else a list"""
+        result = [
+            {"label": self.id2label[i], "score": float(scores[i])}
+            for i in top_k(scores, k)
+        ]
 
         if not include_score:
             result = [r["label"] for r in result]
 
-        return result[:k]
+        return result[0] if k == 1 else result
 
     def __call__(self, text, *, k: int = 1) -> Union[List[Dict], List[str]]:
-        chunks = self.preprocess(text)
-        results = self.pipe(chunks, top_k=k, padding=True, truncation=True)
+        scores = self.forward(self.preprocess(text))
+        results = [
+            [{"label": self.id2label[i], "score": float(row[i])} for i in indices]
+            for row, indices in zip(scores, top_k(scores, k))
+        ]
         return flatten(results)
 
-    def preprocess(self, text):
-        return list(split_chunks(self.pipe.tokenizer, text))
+    def preprocess(self, text) -> List[Dict]:
+        return chunk_text(
+            self.tokenizer,
+            text,
+            max_length=self.chunk_length,
+            overlap=self.overlap,
+        )
+
+    def forward(self, chunks: List[Dict], batch_size: int = None) -> np.ndarray:
+        """Run the model on pre-tokenized chunks; returns (chunks x labels)"""
+        batch_size = batch_size or self.batch_size
+        scores = np.zeros((len(chunks), self.config.num_labels), dtype=np.float32)
+
+        # Batch chunks of similar length together to keep padding to a minimum
+        order = np.argsort([len(c["input_ids"]) for c in chunks], kind="stable")
+
+        for indices in batched(order, batch_size):
+            input_ids = [chunks[i]["input_ids"] for i in indices]
+
+            if self.session is not None:
+                batch = self.tokenizer.pad(
+                    {"input_ids": input_ids}, return_tensors="np"
+                )
+                inputs = {name: batch[name] for name in INPUT_NAMES}
+                logits = torch.from_numpy(self.session.run(["logits"], inputs)[0])
+            else:
+                batch = self.tokenizer.pad(
+                    {"input_ids": input_ids}, return_tensors="pt"
+                ).to(self.pipe.device)
+
+                with torch.inference_mode():
+                    logits = self.pipe.model(**batch).logits
+
+            scores[indices] = self.activation(logits).float().cpu().numpy()
+
+        return scores
+
+    def activation(self, logits):
+        """Same default as the text-classification pipeline"""
+        config = self.config
+        if (
+            config.problem_type == "multi_label_classification"
+            or config.num_labels == 1
+        ):
+            return logits.sigmoid()
+        return logits.softmax(-1)
@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from thought_log.utils import generate_hash_from_string, models_data_path
+
+ONNX_OPSET = 14
+INPUT_NAMES = ["input_ids", "attention_mask"]
+
+
+def onnx_path(model: str) -> Path:
+    """Where the ONNX export of a model revision is kept
+
+    Local models keep it in an onnx/ folder next to their weights, hub models
+    with the other models under models_data_path().
+    """
+    from thought_log.nlp.registry import revision
+
+    key = generate_hash_from_string(f"{model}:{revision(model)}")
+
+    if Path(model).is_dir():
+        return Path(model).joinpath("onnx", f"model-{key}.onnx")
+
+    return models_data_path().joinpath("onnx", f"{Path(model).name}-{key}.onnx")
+
+
+def export_onnx(model: str) -> Path:
+    """Export a classifier model to ONNX, unless that revision already is"""
+    path = onnx_path(model)
+
+    if path.exists():
+        return path
+
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    torch_model = AutoModelForSequenceClassification.from_pretrained(model)
+    torch_model.resize_token_embeddings(len(tokenizer))
+    torch_model.eval()
+
+    inputs = tokenizer(["hello world"], return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Exported to a temporary file first so a crash never leaves half a model
+    tmp_path = path.with_suffix(".tmp")
+
+    with torch.no_grad():
+        torch.onnx.export(
+            torch_model,
+            tuple(inputs[name] for name in INPUT_NAMES),
+            str(tmp_path),
+            input_names=INPUT_NAMES,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+        )
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_session(model: str):
+    """Start an ONNX Runtime session for a model, exporting it first if needed"""
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError(
+            "The onnx backend needs onnxruntime: pip install 'thought-log[onnx]'"
+        )
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    return onnxruntime.InferenceSession(
+        str(export_onnx(model)), options, providers=["CPUExecutionProvider"]
+    )
@@ -0,0 +1,80 @@
+import time
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, PreTrainedModel
+
+from thought_log.utils import generate_hash_from_string, models_data_path
+
+PRECISIONS = ["fp32", "int8"]
+
+
+def quantize(model: PreTrainedModel) -> PreTrainedModel:
+    """Swap the linear layers for dynamically quantized int8 ones"""
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def quantized_path(model: str) -> Path:
+    """Where the int8 copy of a model revision is cached"""
+    from thought_log.nlp.registry import revision
+
+    key = generate_hash_from_string(f"{model}:{revision(model)}")
+    return models_data_path().joinpath("int8", f"{Path(model).name}-{key}.pt")
+
+
+def load_quantized(model: Union[str, PreTrainedModel]) -> PreTrainedModel:
+    """Load a model quantized to int8, from the on-disk cache when possible
+
+    Only the int8 state dict is cached. A hit quantizes an untrained model
+    built from the config and loads the weights into it, so the fp32 weights
+    are never read and nothing but tensors is unpickled.
+    """
+    if not isinstance(model, str):
+        return quantize(model)
+
+    path = quantized_path(model)
+
+    if path.exists():
+        config = AutoConfig.from_pretrained(model)
+        quantized = quantize(AutoModelForSequenceClassification.from_config(config))
+        quantized.load_state_dict(torch.load(path))
+        return quantized.eval()
+
+    quantized = quantize(AutoModelForSequenceClassification.from_pretrained(model))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(quantized.state_dict(), path)
+    return quantized
+
+
+def drift_report(model: str, texts: List[str], batch_size: int = None) -> Dict:
+    """Compare int8 results with fp32 on the same texts
+
+    Reports how often the top label agrees, how far the scores move and how
+    long each precision took.
+    """
+    from thought_log.nlp.classifier import Classifier
+
+    scores, seconds = {}, {}
+
+    for precision in PRECISIONS:
+        classifier = Classifier(model, model, device="cpu", precision=precision)
+        start = time.perf_counter()
+        scores[precision] = classifier.score_many(texts, batch_size=batch_size)
+        seconds[precision] = time.perf_counter() - start
+
+    fp32, int8 = scores["fp32"], scores["int8"]
+    drift = np.abs(fp32 - int8)
+
+    return {
+        "texts": len(texts),
+        "agreement": float((fp32.argmax(axis=1) == int8.argmax(axis=1)).mean()),
+        "mean_score_drift": float(drift.mean()),
+        "max_score_drift": float(drift.max()),
+        "fp32_seconds": seconds["fp32"],
+        "int8_seconds": seconds["int8"],
+        "speedup": seconds["fp32"] / seconds["int8"],
+    }
@@ -0,0 +1,149 @@
+import gc
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from thought_log.config import (
+    CLASSIFIER_BACKEND,
+    CLASSIFIER_NAMES,
+    CLASSIFIER_PRECISIONS,
+)
+
+_lock = threading.Lock()
+_load_locks = {}
+_classifiers = {}
+_ready = threading.Event()
+
+WEIGHT_SUFFIXES = (".bin", ".safetensors", ".onnx", ".pt")
+
+
+def load_classifier(
+    model: str,
+    device: str = None,
+    precision: str = "fp32",
+    backend: str = CLASSIFIER_BACKEND,
+):
+    """Return a shared classifier for a model path, loading it only once"""
+    key = (model, device, precision, backend)
+    classifier = _classifiers.get(key)
+
+    if classifier is not None:
+        return classifier
+
+    with _lock:
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Only block other callers waiting on the same model
+    with load_lock:
+        classifier = _classifiers.get(key)
+
+        if classifier is None:
+            from thought_log.nlp.classifier import Classifier
+
+            classifier = Classifier(
+                model=model,
+                tokenizer=model,
+                device=device,
+                precision=precision,
+                backend=backend,
+            )
+            _classifiers[key] = classifier
+
+    return classifier
+
+
+def classifier_key(name: str, device: str = None):
+    """load_classifier arguments for a CLASSIFIER_NAMES key, as configured"""
+    return (
+        CLASSIFIER_NAMES[name],
+        device,
+        CLASSIFIER_PRECISIONS[name],
+        CLASSIFIER_BACKEND,
+    )
+
+
+def get_classifier(name: str, device: str = None):
+    """Return a shared classifier by its CLASSIFIER_NAMES key"""
+    return load_classifier(*classifier_key(name, device))
+
+
+def get_classifiers(classifier_names: List[str] = None, device: str = None) -> Dict:
+    if not classifier_names:
+        classifier_names = list(CLASSIFIER_NAMES)
+
+    return {name: get_classifier(name, device=device) for name in classifier_names}
+
+
+def preload(classifier_names: List[str] = None, device: str = None):
+    """Load classifiers up front and mark the registry as ready"""
+    get_classifiers(classifier_names, device=device)
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def clear():
+    """Drop all loaded classifiers"""
+    with _lock:
+        _classifiers.clear()
+        _load_locks.clear()
+        _ready.clear()
+
+
+def unload(classifier_names: List[str], device: str = None):
+    """Drop the named classifiers so their memory can be reclaimed"""
+    with _lock:
+        for name in classifier_names:
+            key = classifier_key(name, device)
+            _classifiers.pop(key, None)
+            _load_locks.pop(key, None)
+        _ready.clear()
+
+    gc.collect()
+
+
+def model_size(name: str) -> Optional[float]:
+    """Size of a classifier's weights on disk in MB, if it is a local path"""
+    model = CLASSIFIER_NAMES[name]
+
+    if not model or not Path(model).is_dir():
+        return None
+
+    weights = [f for f in Path(model).iterdir() if f.suffix in WEIGHT_SUFFIXES]
+    return sum(f.stat().st_size for f in weights) / 2**20
+
+
+def model_fingerprint(name: str) -> str:
+    """Identify the revision and precision a classifier's results come from"""
+    fingerprint = revision(CLASSIFIER_NAMES[name])
+    precision = CLASSIFIER_PRECISIONS[name]
+    return fingerprint if precision == "fp32" else f"{fingerprint}:{precision}"
+
+
+def revision(model: str) -> str:
+    """Identify the revision of a model without loading it
+
+    Local models hash their config and weight file stats, hub models use the
+    commit of their cached snapshot.
+    """
+    if not model:
+        return ""
+
+    if Path(model).is_dir():
+        parts = []
+        for f in sorted(Path(model).iterdir()):
+            if f.name == "config.json":
+                parts.append(f.read_bytes())
+            elif f.suffix in WEIGHT_SUFFIXES:
+                stat = f.stat()
+                parts.append(f"{f.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return hashlib.md5(b"\n".join(parts)).hexdigest()
+
+    from huggingface_hub import try_to_load_from_cache
+
+    config = try_to_load_from_cache(model, "config.json")
+    # Cached files live under snapshots/<commit>/
+    return Path(config).parent.name if isinstance(config, str) else model
@@ -1,17 +1,49 @@
-from typing import Union
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple, Union
 
-import en_core_web_sm
-from spacy.tokens import Doc
+from spacy.tokens import Doc, Span
 
 DEVICES_MAPPING = {"cuda": 0, "cpu": -1}
+# Chunking only needs the tokenizer, so skip loading the trained components
+SPACY_EXCLUDE = [
+    "tok2vec",
+    "tagger",
+    "parser",
+    "senter",
+    "attribute_ruler",
+    "lemmatizer",
+    "ner",
+]
+
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    """Load the spaCy pipeline once per process"""
+    import en_core_web_sm
+
+    nlp = en_core_web_sm.load(exclude=SPACY_EXCLUDE)
+    # Rule-based sentence boundaries are enough for chunking
+    nlp.add_pipe("sentencizer")
+    return nlp
 
 
 def tokenize(text: str) -> Doc:
-    nlp = en_core_web_sm.load()
-    return nlp(text)
+    return get_nlp()(text)
+
+
+def tokenize_many(texts: Iterable[str], batch_size: int = 64) -> Iterable[Doc]:
+    return get_nlp().pipe(texts, batch_size=batch_size)
 
 
 def split_paragraphs(document: Union[Doc, str]):
+    for span in paragraph_spans(document):
+        yield span.text
+
+
+def paragraph_spans(document: Union[Doc, str]) -> Iterable[Span]:
     if isinstance(document, str):
         document = tokenize(document)
 
@@ -19,24 +51,168 @@ def split_paragraphs(document: Union[Doc, str]):
     start = 0
     for token in document:
         if token.is_space and token.text.count("\n") > 1:
-            yield document[start : token.i].text
+            yield document[start : token.i]
             start = token.i
-    yield document[start:].text
+    yield document[start:]
+
 
+def split_chunks(tokenizer, text: Union[Doc, str], per_chunk: int = 512):
+    if getattr(tokenizer, "is_fast", False):
+        for chunk in chunk_text(tokenizer, str(text), per_chunk):
+            yield chunk["text"]
+        return
 
-def split_chunks(tokenizer, text: str, per_chunk: int = 512):
     # This fails because we haven't yet split the text into chunks
-    doc = tokenize(text)
+    doc = tokenize(text) if isinstance(text, str) else text
     num_tokens = len(doc)
     n = per_chunk - len(tokenizer.special_tokens_map)
 
     if num_tokens <= n:
         yield doc.text
+        return
 
     for i in range(0, num_tokens, n):
         yield doc[i : i + n].text
 
 
+def chunk_budget(tokenizer, max_length: int, overlap: int = 0) -> int:
+    """Text tokens per chunk; overlap must leave every chunk new tokens"""
+    n = max_length - tokenizer.num_special_tokens_to_add()
+
+    if not 0 <= overlap < n:
+        raise ValueError(
+            f"Chunk overlap {overlap} must be at least 0 and below the {n} text "
+            f"tokens a chunk of {max_length} holds"
+        )
+
+    return n
+
+
+def encode(tokenizer, text: str):
+    return tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=tokenizer.is_fast,
+        verbose=False,
+    )
+
+
+def chunk_text(
+    tokenizer, text: str, max_length: int = 512, overlap: int = 0
+) -> List[Dict]:
+    """Split text into chunks that fit the model, each with its input_ids
+
+    Token counts come from the model tokenizer. Chunks end on a paragraph or
+    sentence boundary where one is available, and consecutive chunks share
+    `overlap` tokens. Short texts are a single chunk and skip segmentation.
+    """
+    n = chunk_budget(tokenizer, max_length, overlap)
+    return chunk_encoding(tokenizer, text, encode(tokenizer, text), n, overlap)
+
+
+def chunk_texts(
+    tokenizer, texts: List[str], max_length: int = 512, overlap: int = 0
+) -> List[List[Dict]]:
+    """chunk_text for many texts
+
+    Only texts longer than a chunk need sentence boundaries, and those go
+    through spaCy together in one nlp.pipe batch.
+    """
+    n = chunk_budget(tokenizer, max_length, overlap)
+    encodings = [encode(tokenizer, text) for text in texts]
+    long = [
+        i
+        for i, encoding in enumerate(encodings)
+        if len(encoding["input_ids"]) > n and encoding.get("offset_mapping")
+    ]
+    docs = dict(zip(long, tokenize_many(texts[i] for i in long)))
+
+    return [
+        chunk_encoding(tokenizer, text, encoding, n, overlap, docs.get(i))
+        for i, (text, encoding) in enumerate(zip(texts, encodings))
+    ]
+
+
+def chunk_encoding(
+    tokenizer, text: str, encoding, n: int, overlap: int = 0, doc: Doc = None
+) -> List[Dict]:
+    """Chunks of n text tokens from a text and its encoding"""
+    ids = encoding["input_ids"]
+
+    if len(ids) <= n:
+        return [make_chunk(tokenizer, text, ids)]
+
+    offsets = encoding.get("offset_mapping")
+    paragraphs, sentences = (
+        token_boundaries(text, offsets, doc) if offsets else ([], [])
+    )
+    chunks = []
+    start = 0
+
+    while True:
+        end = min(start + n, len(ids))
+
+        if end < len(ids):
+            # Prefer a paragraph break past the middle, then any sentence break
+            end = (
+                find_boundary(paragraphs, start + n // 2, end)
+                or find_boundary(sentences, start, end)
+                or end
+            )
+
+        if offsets:
+            chunk = text[offsets[start][0] : offsets[end - 1][1]]
+        else:
+            chunk = tokenizer.decode(ids[start:end])
+
+        chunks.append(make_chunk(tokenizer, chunk, ids[start:end]))
+
+        if end >= len(ids):
+            return chunks
+
+        start = max(end - overlap, start + 1)
+
+
+def make_chunk(tokenizer, text: str, ids: List[int]) -> Dict:
+    return {"text": text, "input_ids": tokenizer.build_inputs_with_special_tokens(ids)}
+
+
+def token_boundaries(
+    text: str, offsets: List, doc: Doc = None
+) -> Tuple[List[int], List[int]]:
+    """Token indices where paragraphs and sentences start"""
+    if doc is None:
+        doc = tokenize(text)
+    starts = [start for start, _ in offsets]
+
+    def to_tokens(chars):
+        return sorted(set(bisect_left(starts, c) for c in chars) - {0})
+
+    paragraphs = to_tokens(span.start_char for span in paragraph_spans(doc))
+    sentences = to_tokens(sent.start_char for sent in doc.sents)
+    return paragraphs, sentences
+
+
+def find_boundary(boundaries: List[int], after: int, end: int) -> int:
+    """The last boundary in (after, end], if any"""
+    i = bisect_right(boundaries, end) - 1
+    if i >= 0 and boundaries[i] > after:
+        return boundaries[i]
+    return None
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of everything that decides how a tokenizer turns text into ids"""
+    if getattr(tokenizer, "is_fast", False):
+        # Vocab, normalizer and special token templates in one document
+        state = tokenizer.backend_tokenizer.to_str()
+    else:
+        state = json.dumps(
+            [tokenizer.get_vocab(), tokenizer.special_tokens_map], sort_keys=True
+        )
+    return hashlib.md5(f"{type(tokenizer).__name__}:{state}".encode()).hexdigest()
+
+
 def get_device(name: str = None) -> int:
     import torch
 
@@ -0,0 +1,342 @@
+"""Append-only segment store for entries
+
+Entries are appended as compact JSON lines to numbered segment files under
+<storage_dir>/segments/. An SQLite offset index maps each entry's uuid to the
+segment, offset and length of its latest version, so entries can be read by
+zkid or uuid with a single seek. Updates append a new version and repoint the
+index; compaction rewrites the live versions in zkid order and drops the rest.
+The index can always be rebuilt by reading the segments in order, where the
+last version of each uuid wins.
+"""
+import json
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from thought_log.utils import storage_meta_path
+from thought_log.utils.io import DateTimeEncoder
+
+SEGMENTS_DIR = "segments"
+INDEX_NAME = "segments.sqlite3"
+
+_stores = {}
+
+
+def dumps(entry: Dict) -> bytes:
+    line = json.dumps(entry, separators=(",", ":"), cls=DateTimeEncoder)
+    return line.encode("utf-8") + b"\n"
+
+
+class SegmentStore:
+    def __init__(self, storage_dir: Union[str, Path], segment_size: int = 64 * 2**20):
+        self.storage_dir = Path(storage_dir)
+        self.segments_dir = self.storage_dir.joinpath(SEGMENTS_DIR)
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+
+        path = storage_meta_path(storage_dir).joinpath(INDEX_NAME)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Writers queue on the index's write lock, compaction holds it longest
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                uuid TEXT PRIMARY KEY,
+                zkid INTEGER NOT NULL,
+                hash TEXT,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS records_zkid ON records (zkid);
+            CREATE INDEX IF NOT EXISTS records_hash ON records (hash);
+            CREATE INDEX IF NOT EXISTS records_location ON records (segment, offset);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+            """
+        )
+        self.recover()
+
+    def segment_path(self, segment: int) -> Path:
+        return self.segments_dir.joinpath(f"{segment:06d}.jsonl")
+
+    def segments(self) -> List[int]:
+        return sorted(int(p.stem) for p in self.segments_dir.glob("*.jsonl"))
+
+    def get_meta(self, key: str, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    @contextmanager
+    def locked(self):
+        """A transaction holding the index's write lock
+
+        Every process appends under it, so the recorded end is where the
+        next line goes. Whatever lies past it was left by a writer that died
+        before committing, and is indexed (or cut off) first.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.index_from(self.get_meta("segment", 0), self.get_meta("end", 0))
+            yield
+
+    def recover(self):
+        """Index whatever was appended after the last indexed write
+
+        Only the tail of the segments past the recorded end is read, which is
+        empty unless a previous run died between an append and its commit.
+        """
+        with self.locked():
+            pass
+
+    def rebuild(self) -> int:
+        """Reindex every segment from scratch
+
+        Runs in one transaction, so a failure keeps the old index.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM records")
+            self.index_from(0, 0)
+
+        return self.count()
+
+    def index_from(self, segment: int, offset: int):
+        """Index every line from offset in segment on, within a transaction
+
+        A torn write leaves a last line without its newline; it is cut off so
+        the next append starts on a fresh line.
+        """
+        segments = [s for s in self.segments() if s >= segment]
+        end = offset
+
+        for s in segments:
+            end = offset if s == segment else 0
+            for entry, location in self.read_segment(s, end):
+                self.index(entry, *location)
+                end = location[1] + location[2]
+
+            path = self.segment_path(s)
+            if path.stat().st_size > end:
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+
+        if segments:
+            self.set_meta("segment", segments[-1])
+            self.set_meta("end", end)
+
+    def read_segment(self, segment: int, start: int = 0) -> Iterator[Tuple]:
+        """(entry, (segment, offset, length)) for each complete line from start"""
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                yield json.loads(line), (segment, offset, len(line))
+                offset += len(line)
+
+    def index(self, entry: Dict, segment: int, offset: int, length: int):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO records (uuid, zkid, hash, segment, offset, length) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (entry["uuid"], entry["id"], entry.get("_hash"), segment, offset, length),
+        )
+
+    def active_segment(self, size: int) -> int:
+        """The segment to append to, starting a new one once it is full"""
+        segment = self.get_meta("segment", 0)
+        end = self.get_meta("end", 0)
+
+        if segment == 0 or (end and end + size > self.segment_size):
+            segment += 1
+            self.set_meta("end", 0)
+
+        return segment
+
+    def put_many(self, entries: Iterable[Dict]):
+        """Append entries as their latest versions, indexed in one transaction"""
+        with self.locked():
+            self.append(entries)
+
+    def append(self, entries: Iterable[Dict]):
+        """Write and index entries; only call while holding the lock"""
+        f, current = None, None
+
+        try:
+            for entry in entries:
+                line = dumps(entry)
+                segment = self.active_segment(len(line))
+
+                if segment != current:
+                    if f:
+                        f.close()
+                    f, current = open(self.segment_path(segment), "ab"), segment
+
+                offset = self.get_meta("end", 0)
+                f.write(line)
+                self.index(entry, segment, offset, len(line))
+                self.set_meta("segment", segment)
+                self.set_meta("end", offset + len(line))
+        finally:
+            # Written out before the index commits
+            if f:
+                f.close()
+
+    def put(self, entry: Dict) -> Dict:
+        self.put_many([entry])
+        return entry
+
+    def locations(self, where: str, params: Tuple) -> List[Tuple]:
+        # Read in file order so scans are sequential
+        return self.connection.execute(
+            f"SELECT segment, offset, length FROM records WHERE {where} "
+            "ORDER BY segment, offset",
+            params,
+        ).fetchall()
+
+    def read(self, locations: List[Tuple]) -> List[Dict]:
+        entries = []
+        handles = {}
+
+        try:
+            for segment, offset, length in locations:
+                if segment not in handles:
+                    handles[segment] = open(self.segment_path(segment), "rb")
+                f = handles[segment]
+                f.seek(offset)
+                entries.append(json.loads(f.read(length)))
+        finally:
+            for f in handles.values():
+                f.close()
+
+        return entries
+
+    def get(self, uuid: str) -> Union[Dict, None]:
+        entries = self.read(self.locations("uuid = ?", (uuid,)))
+        return entries[0] if entries else None
+
+    def find(self, zkid: int) -> List[Dict]:
+        return self.read(self.locations("zkid = ?", (zkid,)))
+
+    def read_many(self, zkids: List[int]) -> List[Dict]:
+        """Entries of many zkids, read in segment order"""
+        placeholders = ",".join("?" * len(zkids))
+        return self.read(self.locations(f"zkid IN ({placeholders})", tuple(zkids)))
+
+    def exists(self, _hash: str = None, uuid: str = None) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM records WHERE hash = ? OR uuid = ? LIMIT 1", (_hash, uuid)
+        ).fetchone()
+        return row is not None
+
+    def zkid_range(
+        self,
+        since: int = None,
+        until: int = None,
+        reverse: bool = False,
+        limit: int = -1,
+    ) -> List[int]:
+        """Sorted distinct zkids between since and until (inclusive)"""
+        order = "DESC" if reverse else "ASC"
+        rows = self.connection.execute(
+            "SELECT DISTINCT zkid FROM records WHERE zkid >= ? AND zkid <= ? "
+            f"ORDER BY zkid {order} LIMIT ?",
+            (
+                0 if since is None else since,
+                2**63 - 1 if until is None else until,
+                limit,
+            ),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def garbage_ratio(self) -> float:
+        """Share of segment bytes taken by superseded versions"""
+        total = sum(self.segment_path(s).stat().st_size for s in self.segments())
+        live = self.connection.execute(
+            "SELECT COALESCE(SUM(length), 0) FROM records"
+        ).fetchone()[0]
+        return 1 - live / total if total else 0.0
+
+    def compact(self) -> int:
+        """Rewrite the live versions in zkid order and remove the old segments
+
+        Holds the write lock throughout, so no other process appends to or
+        updates the store meanwhile. New segments are numbered after the old
+        ones and the old ones are only removed once the index pointing at the
+        copies has committed, so a crash at any point leaves a readable
+        store; rebuild prefers the later copies. Returns the bytes reclaimed.
+        """
+        with self.locked():
+            old_segments = self.segments()
+            before = sum(self.segment_path(s).stat().st_size for s in old_segments)
+            rows = self.connection.execute(
+                "SELECT segment, offset, length FROM records ORDER BY zkid, uuid"
+            ).fetchall()
+
+            # Start a fresh segment so nothing is appended to an old one
+            self.set_meta("end", self.segment_size)
+
+            for batch_start in range(0, len(rows), 1000):
+                self.append(self.read(rows[batch_start : batch_start + 1000]))
+
+        for segment in old_segments:
+            self.segment_path(segment).unlink()
+
+        after = sum(self.segment_path(s).stat().st_size for s in self.segments())
+        return before - after
+
+    def close(self):
+        self.connection.close()
+
+
+def get_store(storage_dir: Union[str, Path]) -> SegmentStore:
+    """The segment store of a storage directory, opened once per process"""
+    from thought_log.config import SEGMENT_SIZE
+
+    key = str(Path(storage_dir).resolve())
+
+    if key not in _stores:
+        _stores[key] = SegmentStore(storage_dir, segment_size=SEGMENT_SIZE)
+
+    return _stores[key]
+
+
+def pack(storage_dir: Union[str, Path]) -> int:
+    """Copy entry files into the segment store, skipping ones already there
+
+    The files are left in place; safe to rerun if interrupted.
+    """
+    from thought_log.entry_index import get_index, parse_filename
+    from thought_log.utils import batched, read_json
+
+    store = get_store(storage_dir)
+    packed = 0
+
+    for filepaths in batched(get_index(storage_dir).all_filepaths(), 1000):
+        entries = []
+
+        for filepath in filepaths:
+            zkid, uuid, _ = parse_filename(filepath)
+
+            if not store.exists(uuid=uuid):
+                entry = read_json(filepath)
+                entry.setdefault("id", zkid)
+                entry.setdefault("uuid", uuid)
+                entries.append(entry)
+
+        # One transaction per batch; an interrupted pack resumes after it
+        store.put_many(entries)
+        packed += len(entries)
+
+    return packed
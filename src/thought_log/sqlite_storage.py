@@ -0,0 +1,520 @@
+"""Embedded SQLite backend with the subset of the pymongo API Storage uses
+
+Documents are stored as JSON text, one table per collection, and queried
+with the JSON1 json_extract function so that indexes created through
+create_indexes can serve lookups.
+"""
+import copy
+import json
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from thought_log.utils.io import DateTimeEncoder
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+NATURAL = "$natural"
+COMPARISONS = {
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+    "$ne": "IS NOT",
+}
+
+
+def field_expr(field: str) -> str:
+    """SQL expression for a document field
+
+    Field names are inlined rather than bound so the expression matches the
+    one used by expression indexes.
+    """
+    if field == NATURAL:
+        return "rowid"
+
+    if not FIELD_PATTERN.match(field):
+        raise ValueError(f"Unsupported field name: {field}")
+
+    return f"json_extract(doc, '$.{field}')"
+
+
+def quote_name(name: str) -> str:
+    if not FIELD_PATTERN.match(name):
+        raise ValueError(f"Unsupported name: {name}")
+    return f'"{name}"'
+
+
+def build_where(params: Dict) -> Tuple[str, List]:
+    """Translate a Mongo filter into a SQL condition and its parameters"""
+    if not params:
+        return "1", []
+
+    clauses = []
+    values = []
+
+    for key, value in params.items():
+        if key in ("$or", "$and"):
+            parts = [build_where(p) for p in value]
+            joiner = " OR " if key == "$or" else " AND "
+            clauses.append("(" + joiner.join(p[0] for p in parts) + ")")
+            values.extend(v for p in parts for v in p[1])
+        elif isinstance(value, Dict) and any(k.startswith("$") for k in value):
+            for op, operand in value.items():
+                clause, clause_values = build_condition(key, op, operand)
+                clauses.append(clause)
+                values.extend(clause_values)
+        else:
+            clause, clause_values = build_condition(key, "$eq", value)
+            clauses.append(clause)
+            values.extend(clause_values)
+
+    return " AND ".join(clauses), values
+
+
+def build_condition(field: str, op: str, operand) -> Tuple[str, List]:
+    expr = field_expr(field)
+
+    if op == "$eq":
+        return f"{expr} IS ?", [to_sql(operand)]
+    if op in COMPARISONS:
+        return f"{expr} {COMPARISONS[op]} ?", [to_sql(operand)]
+    if op in ("$in", "$nin"):
+        operand = list(operand)
+        if not operand:
+            return ("0" if op == "$in" else "1"), []
+        placeholders = ", ".join("?" for _ in operand)
+        negate = "NOT " if op == "$nin" else ""
+        return f"{expr} {negate}IN ({placeholders})", list(map(to_sql, operand))
+    if op == "$exists":
+        check = "IS NOT" if operand else "IS"
+        return f"json_type(doc, '$.{field}') {check} NULL", []
+
+    raise NotImplementedError(f"Unsupported query operator: {op}")
+
+
+def to_sql(value):
+    if isinstance(value, (Dict, List)):
+        raise NotImplementedError("Matching on embedded documents is not supported")
+    return value
+
+
+def build_order(sort: List[Tuple[str, int]]) -> str:
+    if not sort:
+        return ""
+
+    order = [
+        f"{field_expr(key)} {'ASC' if direction == ASCENDING else 'DESC'}"
+        for key, direction in sort
+    ]
+    return " ORDER BY " + ", ".join(order)
+
+
+def normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or ASCENDING)]
+    return list(key_or_list)
+
+
+def project(doc: Dict, projection: Dict = None) -> Dict:
+    if not projection:
+        return doc
+
+    include = {k for k, v in projection.items() if v and k != "_id"}
+
+    if include:
+        result = {k: v for k, v in doc.items() if k in include}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+def get_path(doc: Dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, Dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def set_path(doc: Dict, path: str, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def unset_path(doc: Dict, path: str):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def apply_update(doc: Dict, update: Dict, is_insert: bool = False) -> Dict:
+    """Apply a Mongo update document ($set, $inc, ...) to a copy of doc"""
+    doc = copy.deepcopy(doc)
+
+    for op, changes in update.items():
+        for path, value in changes.items():
+            current = get_path(doc, path)
+
+            if op == "$set" or (op == "$setOnInsert" and is_insert):
+                set_path(doc, path, value)
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$inc":
+                set_path(doc, path, (current or 0) + value)
+            elif op == "$max":
+                set_path(doc, path, value if current is None else max(current, value))
+            elif op == "$min":
+                set_path(doc, path, value if current is None else min(current, value))
+            elif op == "$unset":
+                unset_path(doc, path)
+            else:
+                raise NotImplementedError(f"Unsupported update operator: {op}")
+
+    return doc
+
+
+def upsert_seed(params: Dict) -> Dict:
+    """Equality fields of a filter become fields of an upserted document"""
+    return {
+        k: v
+        for k, v in (params or {}).items()
+        if not k.startswith("$") and not isinstance(v, Dict)
+    }
+
+
+class Insert(InsertOne):
+    """An InsertOne whose document stays readable
+
+    pymongo keeps operation arguments in private slots, so Storage builds
+    these for bulk_write; MongoDB takes them as plain InsertOne requests.
+    """
+
+    def __init__(self, document: Dict):
+        super().__init__(document)
+        self.document = document
+
+
+class Replace(ReplaceOne):
+    """A ReplaceOne whose arguments stay readable, see Insert"""
+
+    def __init__(self, filter: Dict, replacement: Dict, upsert: bool = False):
+        super().__init__(filter, replacement, upsert=upsert)
+        self.filter = filter
+        self.replacement = replacement
+        self.upsert = upsert
+
+
+class SQLiteCursor:
+    def __init__(
+        self,
+        collection: "SQLiteCollection",
+        params: Dict = None,
+        projection: Dict = None,
+        sort=None,
+        limit: int = 0,
+        batch_size: int = 100,
+    ):
+        self._collection = collection
+        self._params = params
+        self._projection = projection
+        self._sort = normalize_sort(sort)
+        self._limit = limit
+        self._batch_size = batch_size or 100
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int):
+        self._batch_size = batch_size
+        return self
+
+    def sql(self) -> Tuple[str, List]:
+        where, values = build_where(self._params)
+        sql = f"SELECT doc FROM {quote_name(self._collection.name)} WHERE {where}"
+        sql += build_order(self._sort)
+
+        if self._limit:
+            sql += " LIMIT ?"
+            values.append(self._limit)
+
+        return sql, values
+
+    def __iter__(self):
+        sql, values = self.sql()
+        db = self._collection.database
+
+        with db.lock:
+            db.ensure_table(self._collection.name)
+            cursor = db.connection.execute(sql, values)
+
+        while True:
+            with db.lock:
+                rows = cursor.fetchmany(self._batch_size)
+            if not rows:
+                break
+            for (doc,) in rows:
+                yield project(json.loads(doc), self._projection)
+
+    def explain(self) -> Dict:
+        """Mimic the queryPlanner shape of a Mongo explain"""
+        sql, values = self.sql()
+        db = self._collection.database
+
+        with db.lock:
+            db.ensure_table(self._collection.name)
+            details = [
+                row[-1]
+                for row in db.connection.execute(f"EXPLAIN QUERY PLAN {sql}", values)
+            ]
+
+        if any("USING INDEX" in detail for detail in details):
+            plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+        else:
+            plan = {"stage": "COLLSCAN"}
+
+        return {"queryPlanner": {"winningPlan": plan, "sqlite": details}}
+
+
+class SQLiteCollection:
+    def __init__(self, database: "SQLiteDatabase", name: str):
+        self.database = database
+        self.name = name
+
+    def find(self, filter: Dict = None, projection: Dict = None, **kwargs):
+        return SQLiteCursor(self, filter, projection, **kwargs)
+
+    def find_one(self, filter: Dict = None, projection: Dict = None, sort=None):
+        return next(iter(self.find(filter, projection, sort=sort, limit=1)), None)
+
+    def insert_one(self, document: Dict):
+        with self.database.lock, self.database.connection:
+            self._insert(document)
+        return document
+
+    def replace_one(self, filter: Dict, replacement: Dict, upsert: bool = False):
+        with self.database.lock, self.database.connection:
+            return self._replace(filter, replacement, upsert=upsert)
+
+    def find_one_and_update(
+        self,
+        filter: Dict,
+        update: Dict,
+        projection: Dict = None,
+        sort=None,
+        upsert: bool = False,
+        return_document: bool = False,
+    ):
+        with self.database.lock, self.database.connection:
+            old = self._find_row(filter, sort)
+
+            if old is None:
+                if not upsert:
+                    return None
+                new = apply_update(upsert_seed(filter), update, is_insert=True)
+                self._insert(new)
+                return project(new, projection) if return_document else None
+
+            rowid, doc = old
+            new = apply_update(doc, update)
+            self._write(rowid, new)
+
+        return project(new if return_document else doc, projection)
+
+    def bulk_write(self, requests: List, ordered: bool = True):
+        errors = []
+
+        with self.database.lock, self.database.connection:
+            for index, request in enumerate(requests):
+                try:
+                    if isinstance(request, Insert):
+                        self._insert(request.document)
+                    elif isinstance(request, Replace):
+                        self._replace(
+                            request.filter, request.replacement, upsert=request.upsert
+                        )
+                    else:
+                        raise NotImplementedError(
+                            f"Unsupported request: {request}, use Insert or Replace"
+                        )
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                    if ordered:
+                        break
+
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+    def create_indexes(self, indexes: List) -> List[str]:
+        names = []
+
+        with self.database.lock, self.database.connection:
+            self.database.ensure_table(self.name)
+
+            for index in indexes:
+                document = index.document
+                name = f"{self.name}_{document['name']}".replace("-", "_")
+                columns = ", ".join(
+                    f"{field_expr(key)} {'ASC' if direction == ASCENDING else 'DESC'}"
+                    for key, direction in document["key"].items()
+                )
+                unique = "UNIQUE " if document.get("unique") else ""
+                try:
+                    self.database.connection.execute(
+                        f"CREATE {unique}INDEX IF NOT EXISTS {quote_name(name)} "
+                        f"ON {quote_name(self.name)} ({columns})"
+                    )
+                except sqlite3.IntegrityError as e:
+                    # Raised by MongoDB too when existing documents collide
+                    raise DuplicateKeyError(str(e), 11000)
+                names.append(document["name"])
+
+        return names
+
+    def aggregate(self, pipeline: List[Dict]):
+        """Support the $match, $sort, $limit and $lookup stages"""
+        docs = None
+
+        for stage in pipeline:
+            (op, spec), *_ = stage.items()
+
+            if op == "$match" and docs is None:
+                docs = list(self.find(spec))
+                continue
+
+            if docs is None:
+                docs = list(self.find())
+
+            if op == "$match":
+                docs = [doc for doc in docs if self._matches(doc, spec)]
+            elif op == "$sort":
+                # Stable sorts applied from the last key to the first
+                for key, direction in reversed(list(spec.items())):
+                    docs.sort(
+                        key=lambda doc: (
+                            get_path(doc, key) is not None,
+                            get_path(doc, key),
+                        ),
+                        reverse=direction != ASCENDING,
+                    )
+            elif op == "$limit":
+                docs = docs[:spec]
+            elif op == "$lookup":
+                self._lookup(docs, **spec)
+            else:
+                raise NotImplementedError(f"Unsupported aggregation stage: {op}")
+
+        return iter(docs if docs is not None else self.find())
+
+    def _lookup(self, docs: List[Dict], **spec):
+        local_field = spec["localField"]
+        foreign_field = spec["foreignField"]
+        local_values = [get_path(doc, local_field) for doc in docs]
+        children = {}
+
+        for child in self.database[spec["from"]].find(
+            {foreign_field: {"$in": local_values}}
+        ):
+            children.setdefault(get_path(child, foreign_field), []).append(child)
+
+        for doc in docs:
+            doc[spec["as"]] = children.get(get_path(doc, local_field), [])
+
+    def _matches(self, doc: Dict, params: Dict) -> bool:
+        where, values = build_where(params)
+
+        with self.database.lock:
+            row = self.database.connection.execute(
+                f"SELECT {where} FROM (SELECT ? AS doc)",
+                [json.dumps(doc, cls=DateTimeEncoder)] + values,
+            ).fetchone()
+
+        return bool(row[0])
+
+    def _find_row(self, params: Dict, sort=None):
+        where, values = build_where(params)
+        self.database.ensure_table(self.name)
+        row = self.database.connection.execute(
+            f"SELECT rowid, doc FROM {quote_name(self.name)} WHERE {where}"
+            f"{build_order(normalize_sort(sort))} LIMIT 1",
+            values,
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _insert(self, document: Dict):
+        if "_id" not in document:
+            document["_id"] = str(ObjectId())
+
+        self.database.ensure_table(self.name)
+
+        try:
+            self.database.connection.execute(
+                f"INSERT INTO {quote_name(self.name)} (_id, doc) VALUES (?, ?)",
+                (str(document["_id"]), json.dumps(document, cls=DateTimeEncoder)),
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(str(e), 11000)
+
+    def _write(self, rowid: int, document: Dict):
+        try:
+            self.database.connection.execute(
+                f"UPDATE {quote_name(self.name)} SET doc = ? WHERE rowid = ?",
+                (json.dumps(document, cls=DateTimeEncoder), rowid),
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(str(e), 11000)
+
+    def _replace(self, params: Dict, replacement: Dict, upsert: bool = False):
+        old = self._find_row(params)
+
+        if old is None:
+            if upsert:
+                self._insert({**upsert_seed(params), **replacement})
+            return
+
+        rowid, doc = old
+        replacement = dict(replacement)
+        replacement["_id"] = doc["_id"]
+        self._write(rowid, replacement)
+
+
+class SQLiteDatabase:
+    """A file (or ":memory:") database; collections are created on demand"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = str(path)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._tables = set()
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        return SQLiteCollection(self, name)
+
+    def ensure_table(self, name: str):
+        if name in self._tables:
+            return
+
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_name(name)} "
+            "(_id TEXT PRIMARY KEY, doc TEXT NOT NULL)"
+        )
+        self._tables.add(name)
+
+    def close(self):
+        self.connection.close()
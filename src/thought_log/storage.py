@@ -1,9 +1,29 @@
+import base64
 import json
-from typing import List, Dict, Union
-
-from pymongo import MongoClient, ASCENDING, DESCENDING
-
-from thought_log.config import MONGO_URL, MONGO_DB_NAME
+import os
+import threading
+from typing import List, Dict, Tuple, Union
+
+from pymongo import (
+    MongoClient,
+    ASCENDING,
+    DESCENDING,
+    IndexModel,
+    ReturnDocument,
+)
+from pymongo.errors import BulkWriteError
+
+from thought_log.config import (
+    DB_BACKEND,
+    MONGO_COMPRESSORS,
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_URL,
+    SQLITE_PATH,
+)
+from thought_log.sqlite_storage import Insert, Replace, SQLiteDatabase
 from thought_log.utils import timestamp
 
 
@@ -16,12 +36,57 @@ ORDER = {
     "DESC": DESCENDING,
 }
 IGNORE_PREFIX = "_"
+COUNTERS_COLLECTION = "counters"
+SEQUENCE_KEY = "seq"
+# Fields find_page can sort and page by
+KEYSET_FIELDS = ["id", "created"]
+
+
+def identify(obj: Dict, identifier_keys: List[str]) -> Dict:
+    """Build a filter from the identifier values of an object"""
+    return dict(map(lambda i: (i, obj.get(i)), identifier_keys))
+
+
+def counter_id(collection_name: str, autoincrement: str) -> str:
+    return f"{collection_name}.{autoincrement}"
+
+
+def encode_cursor(values: List) -> str:
+    """Encode keyset values as an opaque url-safe token"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode()
+
+
+def decode_cursor(token: str) -> List:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode("utf-8")))
+    except (ValueError, TypeError):
+        values = None
+
+    if not isinstance(values, list):
+        raise ValueError(f"Invalid cursor: {token}")
+
+    return values
+
+
+def keyset_params(keys: List[str], values: List, order: str = "ASC") -> Dict:
+    """Build a filter for records strictly after `values` in `keys` order"""
+    op = "$lt" if order == "DESC" else "$gt"
+    conditions = []
+
+    for i, key in enumerate(keys):
+        condition = dict(zip(keys[:i], values[:i]))
+        condition[key] = {op: values[i]}
+        conditions.append(condition)
+
+    return conditions[0] if len(conditions) == 1 else {"$or": conditions}
 
 
 class BaseDocument:
     COLLECTION_NAME = None
     HAS_MANY = None
     BELONGS_TO = None
+    # List of (keys, options) passed to pymongo.IndexModel
+    INDEXES = []
 
     def __init__(
         self, data, base_fields: List[str], add_fields: List[str] = None
@@ -30,6 +95,7 @@ class BaseDocument:
         self._fields = base_fields + (add_fields or [])
         self._created = None
         self._edited = None
+        self._embedded = {}
 
     def sanitize(self, data):
         if isinstance(data, Dict):
@@ -48,47 +114,175 @@ class BaseDocument:
         self.upsert(self)
 
     @classmethod
-    def find(cls, *args, **kwargs):
+    def find(
+        cls,
+        *args,
+        embed: str = None,
+        embed_limit: int = None,
+        embed_fields: List[str] = None,
+        **kwargs,
+    ):
         """Returns a list of results"""
-        return list(map(cls, cls.find_cursor(*args, **kwargs)))
+        results = list(map(cls, cls.find_cursor(*args, **kwargs)))
+
+        if embed:
+            cls.embed_children(results, embed, limit=embed_limit, fields=embed_fields)
+
+        return results
 
     @classmethod
     def find_cursor(cls, *args, **kwargs):
         """Returns a cursor"""
         return storage.db[cls.COLLECTION_NAME].find(*args, **kwargs)
 
+    @classmethod
+    def projection(cls, fields: List[str] = None, required: List[str] = None):
+        """Build a projection for `fields`, always including `required`"""
+        if not fields:
+            return None
+
+        unknown = set(fields) - set(cls.FIELDNAMES)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        projection = {f: 1 for f in list(fields) + (required or [])}
+        projection["_id"] = 0
+        return projection
+
+    @classmethod
+    def stream(
+        cls, params: Dict = None, fields: List[str] = None, batch_size: int = 500
+    ):
+        """Yield instances straight from the cursor, in id order"""
+        cursor = cls.find_cursor(
+            params,
+            cls.projection(fields),
+            sort=[("id", ASCENDING)],
+            batch_size=batch_size,
+        )
+        for item in cursor:
+            yield cls(item)
+
+    @classmethod
+    def find_page(
+        cls,
+        limit: int,
+        after: str = None,
+        sort: str = "id",
+        fields: List[str] = None,
+    ) -> Tuple[List, str]:
+        """Return one keyset-paginated page and the cursor for the next one
+
+        `sort` is a keyset field, prefixed with "-" for descending order.
+        Ties on non-unique fields are broken by id.
+        """
+        order = "DESC" if sort.startswith("-") else "ASC"
+        sort = sort.lstrip("-")
+
+        if sort not in KEYSET_FIELDS:
+            raise ValueError(f"Cannot sort by {sort}")
+
+        keys = [sort] if sort == "id" else [sort, "id"]
+        params = {}
+
+        if after:
+            values = decode_cursor(after)
+            if len(values) != len(keys):
+                raise ValueError(f"Invalid cursor: {after}")
+            params = keyset_params(keys, values, order)
+
+        cursor = cls.find_cursor(
+            params,
+            cls.projection(fields, keys),
+            sort=[(key, ORDER[order]) for key in keys],
+            limit=limit + 1,
+        )
+        records = list(map(cls, cursor))
+        next_cursor = None
+
+        # The extra record only tells us whether there is another page
+        if len(records) > limit:
+            records = records[:limit]
+            last = records[-1]
+            next_cursor = encode_cursor([getattr(last, key, None) for key in keys])
+
+        return records, next_cursor
+
     @classmethod
     def find_one(cls, *args, **kwargs):
         """Returns an instance of the class"""
         return cls(storage.db[cls.COLLECTION_NAME].find_one(*args, **kwargs))
 
     # setattr
-    def get_children(self):
-        cursor = storage.db[self.COLLECTION_NAME].aggregate(
-            [
-                {"$match": {"id": self.id}},
-                {
-                    "$lookup": {
-                        "from": self.HAS_MANY.COLLECTION_NAME,
-                        "localField": f"id",
-                        "foreignField": f"{self.COLLECTION_NAME[:-1]}",
-                        "as": "joinedResult",
-                    }
-                },
-            ]
+    def get_children(self, limit: int = None, fields: List[str] = None):
+        return self.load_children([self], limit=limit, fields=fields)[self.id]
+
+    @classmethod
+    def foreign_key(cls) -> str:
+        """Field on HAS_MANY documents that refers back to this collection"""
+        return cls.COLLECTION_NAME[:-1]
+
+    @classmethod
+    def load_children(
+        cls, parents: List, limit: int = None, fields: List[str] = None
+    ) -> Dict:
+        """Load HAS_MANY children for all parents
+
+        Returns children grouped by parent id. Without a limit, one $in query
+        loads them all; with one, each parent gets its own limited query on
+        the (foreign key, id) index, so no more than `limit` are fetched.
+        """
+        foreign_key = cls.foreign_key()
+        children = {parent.id: [] for parent in parents}
+        projection = cls.HAS_MANY.projection(fields, [foreign_key])
+
+        # Mongo reads a limit of 0 as no limit, so answer it here
+        if not children or (limit is not None and limit < 1):
+            return children
+
+        if limit is not None:
+            for parent_id, group in children.items():
+                cursor = cls.HAS_MANY.find_cursor(
+                    {foreign_key: parent_id},
+                    projection,
+                    sort=[("id", ASCENDING)],
+                    limit=limit,
+                )
+                group.extend(map(cls.HAS_MANY, cursor))
+            return children
+
+        cursor = cls.HAS_MANY.find_cursor(
+            {foreign_key: {"$in": list(children)}},
+            projection,
+            sort=[(foreign_key, ASCENDING), ("id", ASCENDING)],
         )
 
-        results = list(cursor)
+        for item in cursor:
+            children.setdefault(item[foreign_key], []).append(cls.HAS_MANY(item))
 
-        if not results:
-            return []
+        return children
+
+    @classmethod
+    def embed_children(
+        cls,
+        records: List,
+        embed: str,
+        limit: int = None,
+        fields: List[str] = None,
+    ) -> List:
+        """Attach children to every record so to_dict(embed=...) needs no query"""
+        if not cls.HAS_MANY or embed != cls.HAS_MANY.COLLECTION_NAME:
+            raise ValueError(f"Cannot embed {embed} in {cls.COLLECTION_NAME}")
 
-        children = results[0]["joinedResult"]
+        children = cls.load_children(records, limit=limit, fields=fields)
 
-        return list(map(self.HAS_MANY, children))
+        for record in records:
+            record._embedded[embed] = children[record.id]
+
+        return records
 
     @classmethod
-    def upsert(cls, obj):
+    def upsert(cls, obj, ordered: bool = True):
         def convert(o):
             if not isinstance(o, cls):
                 o = cls(o)
@@ -99,13 +293,64 @@ class BaseDocument:
         else:
             obj = convert(obj)
 
-        storage.upsert(
+        return storage.upsert(
             cls.COLLECTION_NAME,
             obj,
             identifier_keys=cls.IDENTIFIER_KEYS,
             autoincrement=cls.AUTOINCREMENT,
+            ordered=ordered,
         )
 
+    @classmethod
+    def insert(cls, obj):
+        """Insert a new object and return it as stored"""
+        if not isinstance(obj, cls):
+            obj = cls(obj)
+
+        result = storage.insert_returning(
+            cls.COLLECTION_NAME, obj.to_dict(), autoincrement=cls.AUTOINCREMENT
+        )
+        return cls(result)
+
+    @classmethod
+    def update(cls, obj, upsert: bool = False):
+        """Apply a partial update by identifier keys and return the result
+
+        Returns None if nothing matched and `upsert` is off.
+        """
+        if not isinstance(obj, cls):
+            obj = cls(obj)
+
+        data = obj.to_dict()
+        result = storage.update_returning(
+            cls.COLLECTION_NAME,
+            identify(data, cls.IDENTIFIER_KEYS),
+            data,
+            upsert=upsert,
+        )
+
+        if upsert and cls.AUTOINCREMENT in data:
+            # The upsert may have created the document under the client's id
+            storage.raise_counter(
+                cls.COLLECTION_NAME, cls.AUTOINCREMENT, data[cls.AUTOINCREMENT]
+            )
+
+        return cls(result) if result else None
+
+    @classmethod
+    def save_returning(cls, obj):
+        """Insert or update an object in one write and return the result"""
+        data = obj.to_dict() if isinstance(obj, cls) else obj
+
+        if Storage.is_new(data, cls.AUTOINCREMENT):
+            return cls.insert(obj)
+
+        return cls.update(obj, upsert=True)
+
+    @classmethod
+    def ensure_indexes(cls):
+        return storage.ensure_indexes(cls.COLLECTION_NAME, cls.INDEXES)
+
     @classmethod
     def last(cls):
         """Return the last object"""
@@ -147,25 +392,76 @@ class BaseDocument:
         )
 
         if embed:
-            children = getattr(self, embed)()
+            children = self._embedded.get(embed)
+            if children is None:
+                children = getattr(self, embed)()
             result[embed] = list(map(lambda c: c.to_dict(), children))
 
         return result
 
 
 class Storage:
-    def __init__(self, db_name: str = MONGO_DB_NAME):
-        self._client = MongoClient(MONGO_URL)
-        self._db = self._client[db_name]
+    """Document storage with a client that is created on first use
+
+    The backend is MongoDB, or an embedded SQLite database when `backend` is
+    "sqlite" (`url` is then a file path or ":memory:"). The client is rebuilt
+    in a forked child, since clients must not be shared across processes.
+    """
+
+    def __init__(
+        self,
+        db_name: str = MONGO_DB_NAME,
+        url: str = None,
+        backend: str = DB_BACKEND,
+    ):
+        self._db_name = db_name
+        self._backend = backend
+        self._url = url or (SQLITE_PATH if backend == "sqlite" else MONGO_URL)
+        self._client = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
 
     @property
     def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self.connect()
         return self._client
 
     @property
     def db(self):
+        if self._db is None or self._pid != os.getpid():
+            self.client
         return self._db
 
+    def connect(self):
+        if self._backend == "sqlite":
+            self._client = SQLiteDatabase(self._url)
+            self._db = self._client
+            self._pid = os.getpid()
+            return
+
+        options = {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        }
+        if MONGO_COMPRESSORS:
+            options["compressors"] = MONGO_COMPRESSORS
+
+        self._client = MongoClient(self._url, connect=False, **options)
+        self._db = self._client[self._db_name]
+        self._pid = os.getpid()
+
+    def reset(self):
+        """Drop the client without closing it; used after a fork"""
+        self._client = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
     def upsert(
         self,
         collection_name: str,
@@ -173,12 +469,13 @@ class Storage:
         find_obj: StorageObj = None,
         identifier_keys: List[str] = None,
         autoincrement: str = None,
+        ordered: bool = True,
     ):
         if not obj:
             return
 
         if isinstance(obj, Dict):
-            self.upsert_one(
+            return self.upsert_one(
                 collection_name,
                 obj,
                 find_obj=find_obj,
@@ -186,12 +483,12 @@ class Storage:
                 autoincrement=autoincrement,
             )
         elif isinstance(obj, List):
-            self.upsert_many(
+            return self.upsert_many(
                 collection_name,
                 obj,
-                find_obj=find_obj,
                 identifier_keys=identifier_keys,
                 autoincrement=autoincrement,
+                ordered=ordered,
             )
 
     def upsert_one(
@@ -205,11 +502,7 @@ class Storage:
         if not find_obj:
             find_obj = obj
 
-        has_autoincrement = bool(autoincrement) and autoincrement not in obj
-        has_id = bool(obj.get("id", None))
-        is_new_obj = has_autoincrement or not has_id
-
-        if is_new_obj:
+        if self.is_new(obj, autoincrement):
             # Only get next sequence if storage obj doesn't have the autoincremented value
             find_obj.update(
                 {
@@ -221,7 +514,7 @@ class Storage:
             obj.update({"created": timestamp()})
         else:
             if identifier_keys:
-                find_obj = dict(map(lambda i: (i, obj.get(i)), identifier_keys))
+                find_obj = identify(obj, identifier_keys)
             obj.update({"edited": timestamp()})
             old_obj = self.db[collection_name].find_one(find_obj)
             old_obj.update(obj)
@@ -229,34 +522,224 @@ class Storage:
 
         self.db[collection_name].replace_one(find_obj, obj, upsert=True)
 
-    def get_next_sequence(self, collection_name, autoincrement):
-        last_obj = self.last(collection_name) or {}
-        sequence_value = last_obj.get(autoincrement, 1)
+    def insert_returning(
+        self, collection_name: str, obj: Dict, autoincrement: str = None
+    ) -> Dict:
+        """Insert obj and return it as stored
+
+        An id that is already taken raises DuplicateKeyError through the
+        unique index rather than returning the other document.
+        """
+        obj.update({"created": timestamp()})
+        explicit = autoincrement and autoincrement in obj
+
+        if autoincrement and not explicit:
+            obj[autoincrement] = self.get_next_sequence(collection_name, autoincrement)
+
+        self.db[collection_name].insert_one(obj)
 
-        if last_obj:
-            sequence_value += 1
+        if explicit:
+            self.raise_counter(collection_name, autoincrement, obj[autoincrement])
 
-        return sequence_value
+        return obj
+
+    def update_returning(
+        self,
+        collection_name: str,
+        find_obj: Dict,
+        obj: Dict,
+        upsert: bool = False,
+    ) -> Dict:
+        """$set only the given fields and return the updated document"""
+        changes = {k: v for k, v in obj.items() if k not in find_obj}
+        changes.update({"edited": timestamp()})
+        update = {"$set": changes}
+
+        if upsert and "created" not in changes:
+            update["$setOnInsert"] = {"created": timestamp()}
+
+        return self.db[collection_name].find_one_and_update(
+            find_obj, update, upsert=upsert, return_document=ReturnDocument.AFTER
+        )
+
+    def get_next_sequence(self, collection_name, autoincrement, count: int = 1):
+        """Atomically reserve `count` ids and return the first one"""
+        counter = self.increment_counter(collection_name, autoincrement, count)
+
+        if counter is None:
+            # No counter yet, so start it from the existing max id
+            self.seed_counter(collection_name, autoincrement)
+            counter = self.increment_counter(collection_name, autoincrement, count)
+
+        return counter[SEQUENCE_KEY] - count + 1
+
+    def increment_counter(self, collection_name, autoincrement, count: int = 1):
+        return self.db[COUNTERS_COLLECTION].find_one_and_update(
+            {"_id": counter_id(collection_name, autoincrement)},
+            {"$inc": {SEQUENCE_KEY: count}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def raise_counter(self, collection_name, autoincrement, value: int):
+        """Keep the counter at or above an id that was written explicitly
+
+        Call it after the write, so seeding a missing counter counts it too.
+        """
+        counter = self.db[COUNTERS_COLLECTION].find_one_and_update(
+            {"_id": counter_id(collection_name, autoincrement)},
+            {"$max": {SEQUENCE_KEY: value}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+        if counter is None:
+            counter = self.seed_counter(collection_name, autoincrement)
+
+        return counter
+
+    def seed_counter(self, collection_name, autoincrement):
+        """Raise the counter to the current max id; safe to run repeatedly"""
+        max_obj = self.db[collection_name].find_one(
+            {autoincrement: {"$exists": True}}, sort=[(autoincrement, DESCENDING)]
+        )
+        max_value = max_obj[autoincrement] if max_obj else 0
+
+        return self.db[COUNTERS_COLLECTION].find_one_and_update(
+            {"_id": counter_id(collection_name, autoincrement)},
+            {"$max": {SEQUENCE_KEY: max_value}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
 
     def upsert_many(
         self,
         collection_name: str,
         obj: DictList,
-        find_obj: StorageObj = None,
         identifier_keys: List[str] = None,
         autoincrement: str = None,
-    ):
-        for item in obj:
-            self.upsert_one(
-                collection_name,
-                item,
-                find_obj=find_obj,
-                identifier_keys=identifier_keys,
-                autoincrement=autoincrement,
+        ordered: bool = True,
+    ) -> DictList:
+        """Upsert a list of objects with a single bulk_write
+
+        Returns one result per item with its index, identifier values and a
+        status of "inserted", "updated", "error" or "skipped" (ordered writes
+        stop at the first error).
+        """
+        if not obj:
+            return []
+
+        if not identifier_keys:
+            identifier_keys = ["id"]
+
+        new_items = [item for item in obj if self.is_new(item, autoincrement)]
+        new_ids = set(map(id, new_items))
+        old_objs = self.find_by_identifiers(
+            collection_name,
+            [item for item in obj if not self.is_new(item, autoincrement)],
+            identifier_keys,
+        )
+
+        if new_items and autoincrement:
+            # Reserve a contiguous block of ids with one counter update
+            start = self.get_next_sequence(
+                collection_name, autoincrement, count=len(new_items)
             )
+            for offset, item in enumerate(new_items):
+                item[autoincrement] = start + offset
+
+        operations = []
+        results = []
+
+        for index, item in enumerate(obj):
+            find_obj = identify(item, identifier_keys)
+            old_obj = old_objs.get(tuple(find_obj.values()))
+
+            if old_obj is None:
+                item.update({"created": timestamp()})
+                operations.append(Insert(item))
+                status = "inserted"
+            else:
+                item.update({"edited": timestamp()})
+                old_obj.update(item)
+                operations.append(Replace(find_obj, old_obj, upsert=True))
+                status = "updated"
+
+            results.append({"index": index, **find_obj, "status": status})
+
+        try:
+            self.db[collection_name].bulk_write(operations, ordered=ordered)
+        except BulkWriteError as e:
+            failed = {error["index"]: error for error in e.details["writeErrors"]}
+            for result in results:
+                error = failed.get(result["index"])
+                if error:
+                    result.update({"status": "error", "error": error["errmsg"]})
+                elif ordered and result["index"] > min(failed):
+                    result.update({"status": "skipped"})
+
+        # Ids the client picked for new items, so the counter never hands
+        # them out again; one update for the whole batch
+        explicit_ids = [
+            item[autoincrement]
+            for item, result in zip(obj, results)
+            if autoincrement
+            and result["status"] == "inserted"
+            and id(item) not in new_ids
+        ]
+
+        if explicit_ids:
+            self.raise_counter(collection_name, autoincrement, max(explicit_ids))
+
+        return results
+
+    def find_by_identifiers(
+        self, collection_name: str, obj: DictList, identifier_keys: List[str]
+    ) -> Dict:
+        """Fetch existing objects in one query, keyed by identifier values"""
+        if not obj:
+            return {}
+
+        find_objs = [identify(item, identifier_keys) for item in obj]
+
+        if len(identifier_keys) == 1:
+            key = identifier_keys[0]
+            params = {key: {"$in": [find_obj[key] for find_obj in find_objs]}}
+        else:
+            params = {"$or": find_objs}
+
+        return {
+            tuple(identify(item, identifier_keys).values()): item
+            for item in self.db[collection_name].find(params)
+        }
+
+    @staticmethod
+    def is_new(obj: Dict, autoincrement: str = None) -> bool:
+        has_autoincrement = bool(autoincrement) and autoincrement not in obj
+        has_id = bool(obj.get("id", None))
+        return has_autoincrement or not has_id
+
+    def ensure_indexes(self, collection_name: str, indexes: List) -> List[str]:
+        """Create indexes if missing; existing ones are left untouched"""
+        if not indexes:
+            return []
+
+        return self.db[collection_name].create_indexes(
+            [IndexModel(keys, **options) for keys, options in indexes]
+        )
+
+    def query_plan(self, collection_name: str, params: Dict) -> List[str]:
+        """Return the stages of the winning plan for a find query"""
+        explained = self.db[collection_name].find(params).explain()
+        plan = explained["queryPlanner"]["winningPlan"]
+        stages = []
+
+        while plan:
+            stages.append(plan["stage"])
+            plan = plan.get("inputStage")
+
+        return stages
 
     def last(self, collection_name: str):
-        results = storage.query(
+        results = self.query(
             collection_name=collection_name, sort="$natural", order="DESC", limit=1
         )
         return results[0] if results else None
@@ -281,3 +764,6 @@ class Storage:
 
 
 storage = Storage()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=storage.reset)
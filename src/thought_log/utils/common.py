@@ -8,8 +8,6 @@ from datetime import date, datetime, time
 from pathlib import Path
 from typing import Dict, List, Union
 
-import requests
-from huggingface_hub import snapshot_download
 from tqdm.auto import tqdm
 
 from thought_log.res import urls
@@ -82,9 +80,13 @@ def download_models():
         config_data[f"{name}_path"] = str(extracted[0])
 
     update_config(config_data)
+    return config_data
 
 
 def download(url, source, dest_path=None, revision="main"):
+    import requests
+    from huggingface_hub import snapshot_download
+
     if source == "huggingface":
         snapshot_download(repo_id=url, revision=revision)
         return
@@ -134,12 +136,35 @@ def make_datetime(obj: Union[str, datetime], fmt: str = None):
     return find_datetime(obj)
 
 
-def list_entries(entries_dir, reverse=False, num_entries=-1):
-    entry_ids = sorted(
-        [int(f.stem.split(".")[0]) for f in Path(entries_dir).glob("*.json")],
+def list_entries(entries_dir, reverse=False, num_entries=-1, since=None, until=None):
+    """Sorted zkids of stored entries, from the catalog rather than a glob"""
+    from thought_log.config import STORAGE_ENGINE
+
+    if STORAGE_ENGINE == "segments":
+        from thought_log.segments import get_store as get_catalog
+    else:
+        from thought_log.entry_index import get_index as get_catalog
+
+    return get_catalog(entries_dir).zkid_range(
+        since=to_zkid(since),
+        until=to_zkid(until, end=True),
         reverse=reverse,
+        limit=num_entries,
     )
-    return entry_ids if num_entries < 0 else entry_ids[:num_entries]
+
+
+def to_zkid(value: Union[int, date, datetime, None], end: bool = False):
+    """zkid bound for a date; a plain date ending a range covers the whole day"""
+    if value is None or isinstance(value, int):
+        return value
+
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+
+    if end and value.time() == time.min:
+        value = datetime.combine(value.date(), time.max)
+
+    return zettelkasten_id(value)
 
 
 def window_size():
@@ -170,6 +195,12 @@ def flatten(original_list):
     return [element for sublist in original_list for element in sublist]
 
 
+def batched(items: List, size: int):
+    """Yield consecutive slices of at most size items"""
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
 def frequency(labels, key: str):
     get_label = lambda x: x[key][0]["label"] if "score" in x[key][0] else x[key][0]
     return Counter(list(map(get_label, labels)))
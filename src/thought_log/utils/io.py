@@ -1,15 +1,36 @@
+import bz2
 import csv
 import datetime
+import gzip
 import hashlib
 import json
+import lzma
 from json import JSONEncoder
 from mimetypes import guess_type
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 from uuid import uuid4
 
 import frontmatter
 
+# Standard library codecs entry files can be written with
+COMPRESSIONS = {"gzip": gzip, "bz2": bz2, "lzma": lzma}
+
+try:
+    # Python 3.14+
+    from compression import zstd
+
+    COMPRESSIONS["zstd"] = zstd
+except ImportError:
+    pass
+
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "lzma",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
 
 class DateTimeEncoder(JSONEncoder):
     # https://pynative.com/python-serialize-datetime-into-json/
@@ -50,19 +71,52 @@ def read_csv(filename: str) -> List[Dict]:
         return list(csv_data)
 
 
+def detect_compression(raw: bytes) -> Optional[str]:
+    """Codec a file was written with, from its first bytes; None if plain"""
+    for magic, compression in MAGIC_NUMBERS.items():
+        if raw.startswith(magic):
+            return compression
+
+    return None
+
+
+def get_codec(compression: str):
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unsupported compression {compression}, use one of {list(COMPRESSIONS)}"
+        )
+
+    return COMPRESSIONS[compression]
+
+
 def read_json(filename: str, as_type=None) -> Dict:
-    with open(filename, "r") as json_file:
-        data = json.load(json_file)
+    """Read a JSON file, decompressing it first if it was compressed"""
+    raw = Path(filename).read_bytes()
+    compression = detect_compression(raw)
 
-        if as_type is not None:
-            data = dict([(as_type(k), v) for k, v in data.items()])
+    if compression:
+        raw = get_codec(compression).decompress(raw)
 
-        return data
+    data = json.loads(raw)
+
+    if as_type is not None:
+        data = dict([(as_type(k), v) for k, v in data.items()])
+
+    return data
+
+
+def write_json(data: Dict, filename: str, mode: str = "w+", compression: str = None):
+    """Write data as JSON, compressed with one of COMPRESSIONS if given"""
+    if compression is None:
+        with open(filename, mode) as f:
+            json.dump(data, f, indent=4, cls=DateTimeEncoder)
+            return data
 
+    payload = json.dumps(data, cls=DateTimeEncoder).encode("utf-8")
 
-def write_json(data: Dict, filename: str, mode: str = "w+"):
-    with open(filename, mode) as f:
-        json.dump(data, f, indent=4, cls=DateTimeEncoder)
+    # Appended streams still decompress as one
+    with open(filename, mode[0] + "b") as f:
+        f.write(get_codec(compression).compress(payload))
         return data
 
 
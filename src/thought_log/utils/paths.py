@@ -22,6 +22,11 @@ def models_data_path():
     return app_data_path().joinpath("models")
 
 
+def storage_meta_path(storage_dir):
+    """Bookkeeping files kept next to the entries, out of list_entries' way"""
+    return Path(storage_dir).joinpath(".thought_log")
+
+
 def create_app_dirs():
     paths = [
         config_path(),
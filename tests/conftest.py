@@ -0,0 +1,5 @@
+import freezegun
+
+# freezegun inspects every loaded module; transformers' lazy modules fail
+# to import optional backends when touched
+freezegun.configure(extend_ignore_list=["transformers"])
@@ -0,0 +1,45 @@
+import pytest
+import spacy
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+from thought_log.nlp import utils
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "hello", "world", "again", "."]
+
+
+@pytest.fixture
+def hf_tokenizer(tmp_path):
+    """A tiny wordpiece tokenizer with bert-style special tokens"""
+    vocab_file = tmp_path.joinpath("vocab.txt")
+    vocab_file.write_text("\n".join(VOCAB))
+    yield BertTokenizerFast(vocab_file=str(vocab_file))
+
+
+@pytest.fixture
+def blank_nlp(monkeypatch):
+    """Stand in for en_core_web_sm with a blank English pipeline"""
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    monkeypatch.setattr(utils, "get_nlp", lambda: nlp)
+    yield nlp
+
+
+@pytest.fixture
+def model_path(tmp_path, hf_tokenizer):
+    """A tiny randomly initialised sequence classifier saved to disk"""
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(VOCAB),
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=32,
+        max_position_embeddings=16,
+        id2label={0: "sad", 1: "joyful", 2: "angry"},
+        label2id={"sad": 0, "joyful": 1, "angry": 2},
+    )
+    path = tmp_path.joinpath("model")
+    BertForSequenceClassification(config).save_pretrained(path)
+    hf_tokenizer.save_pretrained(path)
+    yield str(path)
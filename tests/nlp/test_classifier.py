@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from thought_log.nlp.classifier import Classifier, top_k
+from thought_log.nlp.utils import tokenizer_fingerprint
+
+TEXT = "hello world again . " * 10
+
+
+@pytest.fixture
+def classifier(model_path, blank_nlp):
+    yield Classifier(model=model_path, tokenizer=model_path, device="cpu")
+
+
+def test_chunks_fit_model(classifier):
+    chunks = classifier.preprocess(TEXT)
+
+    assert classifier.chunk_length == 16
+    # 40 tokens, cut after every third sentence
+    assert len(chunks) == 4
+    assert all(len(c["input_ids"]) <= 16 for c in chunks)
+
+
+def test_forward_matches_pipeline(classifier):
+    chunks = classifier.preprocess(TEXT)
+    scores = classifier.forward(chunks)
+    expected = classifier.pipe([c["text"] for c in chunks], top_k=None)
+
+    assert scores.shape == (4, 3)
+    for row, results in zip(scores, expected):
+        for result in results:
+            label_id = classifier.label2id[result["label"]]
+            assert row[label_id] == pytest.approx(result["score"], abs=1e-5)
+
+
+def test_classify(classifier):
+    label = classifier.classify(TEXT)
+    labels = classifier.classify(TEXT, k=2, include_score=True)
+
+    assert label in classifier.label2id
+    assert [r["label"] for r in labels][0] == label
+    assert len(labels) == 2
+
+
+def test_classify_averages_every_chunk(classifier):
+    mean = classifier.forward(classifier.preprocess(TEXT)).mean(axis=0)
+    result = classifier.classify(TEXT, k=3, include_score=True)
+
+    assert [r["score"] for r in result] == pytest.approx(sorted(mean, reverse=True))
+    assert [r["label"] for r in result] == [
+        classifier.id2label[i] for i in np.argsort(-mean)
+    ]
+
+
+def test_top_k():
+    scores = np.array([[0.1, 0.7, 0.2], [0.5, 0.1, 0.4]])
+
+    assert top_k(scores, 2).tolist() == [[1, 2], [0, 2]]
+    assert top_k(scores[0], 1).tolist() == [1]
+    assert top_k(scores[0], 5).tolist() == [1, 2, 0]
+
+
+def test_classify_many_matches_classify(classifier):
+    texts = ["hello world .", TEXT, "again again hello ."]
+    results = classifier.classify_many(texts, k=2, include_score=True, batch_size=3)
+
+    for text, result in zip(texts, results):
+        expected = classifier.classify(text, k=2, include_score=True)
+        assert [r["label"] for r in result] == [r["label"] for r in expected]
+        assert [r["score"] for r in result] == pytest.approx(
+            [r["score"] for r in expected], abs=1e-5
+        )
+
+
+def test_forward_keeps_chunk_order(classifier):
+    chunks = classifier.preprocess(TEXT) + classifier.preprocess("hello .")
+    batched = classifier.forward(chunks, batch_size=2)
+    single = np.concatenate([classifier.forward([c]) for c in chunks])
+
+    assert batched == pytest.approx(single, abs=1e-5)
+
+
+def test_chunk_key(classifier, model_path, hf_tokenizer):
+    same = Classifier(model=model_path, tokenizer=model_path, device="cpu")
+    overlapping = Classifier(
+        model=model_path, tokenizer=model_path, device="cpu", overlap=2
+    )
+
+    assert same.chunk_key == classifier.chunk_key
+    assert overlapping.chunk_key != classifier.chunk_key
+
+    hf_tokenizer.add_tokens(["sad"])
+    assert tokenizer_fingerprint(hf_tokenizer) != classifier.chunk_key[0]
+
+
+def test_classify_chunked(classifier):
+    texts = ["hello world .", TEXT]
+    text_chunks = classifier.chunk_many(texts)
+
+    assert classifier.classify_chunked(text_chunks, k=2) == classifier.classify_many(
+        texts, k=2
+    )
+
+
+def test_overlap_must_leave_room(classifier, model_path):
+    # 16 positions minus 2 special tokens
+    budget = classifier.chunk_length - 2
+
+    with pytest.raises(ValueError):
+        Classifier(model=model_path, tokenizer=model_path, overlap=budget)
@@ -0,0 +1,81 @@
+import pytest
+
+from thought_log.nlp import utils
+
+
+def test_split_chunks_short_text(hf_tokenizer):
+    assert list(utils.split_chunks(hf_tokenizer, "hello world", per_chunk=6)) == [
+        "hello world"
+    ]
+
+
+def test_chunk_text_short_text(hf_tokenizer):
+    assert utils.chunk_text(hf_tokenizer, "hello world", max_length=6) == [
+        {"text": "hello world", "input_ids": [2, 5, 6, 3]}
+    ]
+
+
+def test_chunk_text_covers_text_once(hf_tokenizer, blank_nlp):
+    text = " ".join(["hello world"] * 5)
+    chunks = utils.chunk_text(hf_tokenizer, text, max_length=6)
+
+    # 2 special tokens leave 4 tokens per chunk
+    assert [c["text"] for c in chunks] == [
+        "hello world hello world",
+        "hello world hello world",
+        "hello world",
+    ]
+    assert chunks[0]["input_ids"] == [2, 5, 6, 5, 6, 3]
+
+
+def test_chunk_text_sentence_boundaries(hf_tokenizer, blank_nlp):
+    text = "hello . world again hello . world"
+    chunks = utils.chunk_text(hf_tokenizer, text, max_length=7)
+
+    assert [c["text"] for c in chunks] == ["hello .", "world again hello . world"]
+
+
+def test_chunk_text_paragraph_boundaries(hf_tokenizer, blank_nlp):
+    text = "hello world again .\n\nhello . world ."
+    chunks = utils.chunk_text(hf_tokenizer, text, max_length=8)
+
+    assert [c["text"] for c in chunks] == ["hello world again .", "hello . world ."]
+
+
+def test_chunk_text_overlap(hf_tokenizer, blank_nlp):
+    text = "hello world again hello world again"
+    chunks = utils.chunk_text(hf_tokenizer, text, max_length=6, overlap=1)
+
+    assert [c["text"] for c in chunks] == [
+        "hello world again hello",
+        "hello world again",
+    ]
+
+
+def test_chunk_texts_batches_spacy(hf_tokenizer, blank_nlp, monkeypatch):
+    texts = [
+        "hello world",
+        "hello . world again hello . world",
+        "hello world again .\n\nhello . world .",
+    ]
+    expected = [utils.chunk_text(hf_tokenizer, text, max_length=7) for text in texts]
+    piped = []
+
+    def tokenize_many(texts):
+        texts = list(texts)
+        piped.append(texts)
+        return blank_nlp.pipe(texts)
+
+    monkeypatch.setattr(utils, "tokenize_many", tokenize_many)
+    monkeypatch.setattr(utils, "tokenize", None)
+
+    assert utils.chunk_texts(hf_tokenizer, texts, max_length=7) == expected
+    # One batch, holding only the texts that needed splitting
+    assert piped == [texts[1:]]
+
+
+@pytest.mark.parametrize("overlap", [-1, 4, 5])
+def test_chunk_text_rejects_overlap_without_progress(hf_tokenizer, overlap):
+    # 6 positions minus 2 special tokens leave 4 text tokens per chunk
+    with pytest.raises(ValueError):
+        utils.chunk_text(hf_tokenizer, "hello world", max_length=6, overlap=overlap)
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import pytest
+
+from thought_log.nlp.classifier import Classifier
+from thought_log.nlp.onnx_backend import export_onnx, onnx_path
+
+pytest.importorskip("onnxruntime")
+
+TEXT = "hello world again . " * 10
+
+
+def test_export_next_to_model(model_path):
+    path = export_onnx(model_path)
+
+    assert path == onnx_path(model_path)
+    assert path.parent == Path(model_path).joinpath("onnx")
+    mtime = path.stat().st_mtime_ns
+    # Already exported, so it is reused
+    assert export_onnx(model_path).stat().st_mtime_ns == mtime
+
+
+def test_onnx_matches_torch(model_path, blank_nlp):
+    torch_classifier = Classifier(model_path, model_path, device="cpu")
+    onnx_classifier = Classifier(model_path, model_path, backend="onnx")
+
+    assert onnx_classifier.pipe is None
+    assert onnx_classifier.chunk_length == torch_classifier.chunk_length
+
+    chunks = torch_classifier.preprocess(TEXT)
+    expected = torch_classifier.forward(chunks)
+
+    assert onnx_classifier.forward(chunks) == pytest.approx(expected, abs=1e-5)
+    assert onnx_classifier.classify(TEXT, k=2) == torch_classifier.classify(TEXT, k=2)
+
+
+def test_onnx_checks(model_path):
+    with pytest.raises(ValueError):
+        Classifier(model_path, model_path, backend="tensorrt")
+    with pytest.raises(ValueError):
+        Classifier(model_path, model_path, backend="onnx", precision="int8")
@@ -0,0 +1,58 @@
+import pytest
+import torch
+
+from thought_log.nlp import quantization
+from thought_log.nlp.classifier import Classifier
+
+TEXTS = ["hello world .", "again hello world again .", "world world ."]
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(quantization, "models_data_path", lambda: tmp_path)
+    yield tmp_path
+
+
+def is_quantized(model):
+    modules = list(model.modules())
+    return not any(type(m) is torch.nn.Linear for m in modules) and any(
+        isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in modules
+    )
+
+
+def test_load_quantized_caches(model_path, models_dir):
+    path = quantization.quantized_path(model_path)
+    first = quantization.load_quantized(model_path)
+
+    assert path.exists() and path.parent.parent == models_dir
+    assert is_quantized(first)
+    # Only tensors are cached, loadable without unpickling any code
+    assert torch.load(path, weights_only=True)
+
+    cached = quantization.load_quantized(model_path)
+    inputs = {"input_ids": torch.tensor([[1, 2, 3]])}
+    assert is_quantized(cached)
+    assert torch.equal(first(**inputs).logits, cached(**inputs).logits)
+
+
+def test_classifier_int8(model_path, models_dir, blank_nlp):
+    classifier = Classifier(model_path, model_path, device="cpu", precision="int8")
+
+    assert is_quantized(classifier.pipe.model)
+    assert classifier.classify(TEXTS[0]) in classifier.label2id
+
+
+def test_classifier_precision_checks(model_path):
+    with pytest.raises(ValueError):
+        Classifier(model_path, model_path, device="cpu", precision="fp16")
+    with pytest.raises(ValueError):
+        Classifier(model_path, model_path, device="cuda", precision="int8")
+
+
+def test_drift_report(model_path, models_dir, blank_nlp):
+    report = quantization.drift_report(model_path, TEXTS)
+
+    assert report["texts"] == 3
+    assert 0 <= report["agreement"] <= 1
+    assert report["max_score_drift"] >= report["mean_score_drift"] >= 0
+    assert report["speedup"] > 0
@@ -0,0 +1,82 @@
+import sys
+import threading
+from types import ModuleType
+from unittest.mock import Mock
+
+import pytest
+
+from thought_log.nlp import registry
+
+
+@pytest.fixture
+def fake_classifier(monkeypatch):
+    module = ModuleType("thought_log.nlp.classifier")
+    module.Classifier = Mock(side_effect=lambda **kwargs: Mock(**kwargs))
+    monkeypatch.setitem(sys.modules, "thought_log.nlp.classifier", module)
+    registry.clear()
+    yield module.Classifier
+    registry.clear()
+
+
+def test_load_classifier_once(fake_classifier):
+    first = registry.load_classifier("model-path")
+    second = registry.load_classifier("model-path")
+
+    assert first is second
+    assert fake_classifier.call_count == 1
+
+
+def test_load_classifier_threads(fake_classifier):
+    threads = [
+        threading.Thread(target=registry.load_classifier, args=("model-path",))
+        for _ in range(8)
+    ]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fake_classifier.call_count == 1
+
+
+def test_preload(fake_classifier, monkeypatch):
+    monkeypatch.setattr(
+        registry, "CLASSIFIER_NAMES", {"emotion": "emotion-path", "context": "ctx"}
+    )
+
+    assert not registry.is_ready()
+    registry.preload()
+    assert registry.is_ready()
+    assert fake_classifier.call_count == 2
+
+
+def test_unload(fake_classifier, monkeypatch):
+    monkeypatch.setitem(registry.CLASSIFIER_NAMES, "emotion", "model-path")
+    first = registry.get_classifier("emotion")
+    registry.unload(["emotion"])
+
+    assert registry.get_classifier("emotion") is not first
+    assert fake_classifier.call_count == 2
+
+
+def test_model_size(tmp_path, monkeypatch):
+    tmp_path.joinpath("pytorch_model.bin").write_bytes(b"0" * 2**20)
+    tmp_path.joinpath("config.json").write_text("{}")
+    monkeypatch.setitem(registry.CLASSIFIER_NAMES, "emotion", str(tmp_path))
+    monkeypatch.setitem(registry.CLASSIFIER_NAMES, "context", "org/hub-model")
+
+    assert registry.model_size("emotion") == 1
+    assert registry.model_size("context") is None
+
+
+def test_model_fingerprint(tmp_path, monkeypatch):
+    tmp_path.joinpath("config.json").write_text('{"num_labels": 2}')
+    monkeypatch.setitem(registry.CLASSIFIER_NAMES, "emotion", str(tmp_path))
+    first = registry.model_fingerprint("emotion")
+
+    assert registry.model_fingerprint("emotion") == first
+
+    tmp_path.joinpath("config.json").write_text('{"num_labels": 3}')
+
+    assert registry.model_fingerprint("emotion") != first
@@ -0,0 +1,226 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from thought_log import analyzer, entry_handler, segments
+from thought_log.analyzer import analyze_corpus, analyze_entries, plan_passes
+from thought_log.nlp import registry
+
+SIZES = {"emotion": 300, "sentiment": 250, "context": 500}
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(analyzer, "STORAGE_DIR", tmp_path)
+    monkeypatch.setattr(entry_handler, "STORAGE_DIR", tmp_path)
+
+    for zkid in range(20220101000000, 20220101000003):
+        entry = {"text": f"entry {zkid}"}
+        tmp_path.joinpath(f"{zkid}.uuid{zkid % 10}.hash.json").write_text(
+            json.dumps(entry)
+        )
+
+    yield tmp_path
+
+
+@pytest.fixture
+def model_sizes(monkeypatch):
+    monkeypatch.setattr(registry, "model_size", SIZES.get)
+
+
+def make_classifier(label):
+    classifier = MagicMock()
+    classifier.classify_many.side_effect = lambda texts, **kwargs: [label] * len(texts)
+    return classifier
+
+
+def test_analyze_corpus():
+    classifiers = {"emotion": make_classifier("joy"), "sentiment": make_classifier("+")}
+    entries = [
+        {"text": "one"},
+        {"text": "two", "analysis": {"emotion": "sad"}},
+        {"text": "three", "analysis": {"emotion": "sad", "sentiment": "-"}},
+    ]
+
+    updated = analyze_corpus(
+        entries, classifier_names=["emotion", "sentiment"], classifiers=classifiers
+    )
+
+    assert updated == entries[:2]
+    assert entries[0]["analysis"] == {"emotion": "joy", "sentiment": "+"}
+    assert entries[1]["analysis"] == {"emotion": "sad", "sentiment": "+"}
+    # Each classifier runs once over every entry missing its analysis
+    classifiers["emotion"].classify_many.assert_called_once_with(
+        ["one"], batch_size=None
+    )
+    classifiers["sentiment"].classify_many.assert_called_once_with(
+        ["one", "two"], batch_size=None
+    )
+
+
+@pytest.mark.parametrize(
+    "budget,expected",
+    [
+        (None, [["emotion", "sentiment", "context"]]),
+        (600, [["emotion", "sentiment"], ["context"]]),
+        (400, [["emotion"], ["sentiment"], ["context"]]),
+        (0, [["emotion"], ["sentiment"], ["context"]]),
+    ],
+)
+def test_plan_passes(model_sizes, budget, expected):
+    assert plan_passes(["emotion", "sentiment", "context"], budget) == expected
+
+
+def test_plan_passes_unknown_size(monkeypatch):
+    monkeypatch.setattr(registry, "model_size", lambda name: None)
+
+    assert plan_passes(["emotion", "sentiment"], 10_000) == [
+        ["emotion"],
+        ["sentiment"],
+    ]
+
+
+def test_analyze_entries_model_major(storage_dir, model_sizes, monkeypatch):
+    loaded = []
+    unload = MagicMock()
+
+    def get_classifiers(names):
+        loaded.append(names)
+        return {name: make_classifier(name.upper()) for name in names}
+
+    monkeypatch.setattr(analyzer, "get_classifiers", get_classifiers)
+    monkeypatch.setattr(registry, "unload", unload)
+
+    analyze_entries(
+        classifier_names=["emotion", "sentiment"], corpus_size=2, memory_budget=400
+    )
+
+    # Loaded per group through the registry, never both at once
+    assert loaded == [["emotion"]] * 2 + [["sentiment"]] * 2
+    assert [c.args[0] for c in unload.call_args_list] == [["emotion"], ["sentiment"]]
+    for filepath in storage_dir.glob("*.json"):
+        analysis = json.loads(filepath.read_text())["analysis"]
+        assert analysis == {"emotion": "EMOTION", "sentiment": "SENTIMENT"}
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    fingerprints = {"emotion": "rev1", "sentiment": "rev1"}
+    classifiers = {"emotion": make_classifier("joy"), "sentiment": make_classifier("+")}
+    monkeypatch.setattr(registry, "model_fingerprint", fingerprints.get)
+    monkeypatch.setattr(analyzer, "get_classifiers", lambda names: classifiers)
+    yield fingerprints, classifiers
+
+
+def analyzed_texts(classifier):
+    return [t for c in classifier.classify_many.call_args_list for t in c.args[0]]
+
+
+def test_analyze_entries_incremental(storage_dir, fake_models):
+    fingerprints, classifiers = fake_models
+    names = ["emotion", "sentiment"]
+
+    analyze_entries(classifier_names=names)
+    assert len(analyzed_texts(classifiers["emotion"])) == 3
+
+    # Nothing changed: no model calls and no writes
+    mtimes = {f: f.stat().st_mtime_ns for f in storage_dir.glob("*.json")}
+    classifiers["emotion"].reset_mock()
+    analyze_entries(classifier_names=names)
+    assert analyzed_texts(classifiers["emotion"]) == []
+    assert {f: f.stat().st_mtime_ns for f in storage_dir.glob("*.json")} == mtimes
+
+    # An edited entry is analyzed again
+    edited = sorted(storage_dir.glob("*.json"))[0]
+    entry = json.loads(edited.read_text())
+    entry["text"] = "edited"
+    edited.write_text(json.dumps(entry))
+    analyze_entries(classifier_names=names)
+    assert analyzed_texts(classifiers["emotion"]) == ["edited"]
+
+    # A new model revision reanalyzes everything, same results are not written
+    classifiers["sentiment"].reset_mock()
+    fingerprints["sentiment"] = "rev2"
+    mtimes = {f: f.stat().st_mtime_ns for f in storage_dir.glob("*.json")}
+    analyze_entries(classifier_names=names)
+    assert len(analyzed_texts(classifiers["sentiment"])) == 3
+    assert {f: f.stat().st_mtime_ns for f in storage_dir.glob("*.json")} == mtimes
+
+
+def test_analyze_entries_keeps_existing_results(storage_dir, fake_models):
+    _, classifiers = fake_models
+
+    for filepath in storage_dir.glob("*.json"):
+        entry = json.loads(filepath.read_text())
+        entry["analysis"] = {"emotion": "sad"}
+        filepath.write_text(json.dumps(entry))
+
+    analyze_entries(classifier_names=["emotion"])
+
+    assert analyzed_texts(classifiers["emotion"]) == []
+    assert storage_dir.joinpath(".thought_log", "analysis.json").exists()
+
+
+def test_analyze_entries_workers(storage_dir, fake_models, monkeypatch):
+    # Forked workers inherit the fake models
+    monkeypatch.setattr(analyzer, "WORKER_START_METHOD", "fork")
+
+    analyze_entries(classifier_names=["emotion", "sentiment"], corpus_size=1, workers=2)
+
+    manifest = json.loads(
+        storage_dir.joinpath(".thought_log", "analysis.json").read_text()
+    )
+    assert len(manifest) == 3
+    for filepath in storage_dir.glob("*.json"):
+        analysis = json.loads(filepath.read_text())["analysis"]
+        assert analysis == {"emotion": "joy", "sentiment": "+"}
+        assert manifest[filepath.name]["models"]["emotion"][1] == "rev1"
+
+
+def test_analyze_entries_segments(storage_dir, fake_models, monkeypatch):
+    _, classifiers = fake_models
+    monkeypatch.setattr(analyzer, "STORAGE_ENGINE", "segments")
+    monkeypatch.setattr("thought_log.config.STORAGE_ENGINE", "segments")
+    monkeypatch.setattr(segments, "_stores", {})
+    segments.pack(storage_dir)
+    store = segments.get_store(storage_dir)
+
+    analyze_entries(classifier_names=["emotion"])
+    assert len(analyzed_texts(classifiers["emotion"])) == 3
+    assert store.get("uuid0")["analysis"] == {"emotion": "joy"}
+
+    # Unchanged entries are not appended again
+    size = store.segment_path(store.segments()[-1]).stat().st_size
+    classifiers["emotion"].reset_mock()
+    analyze_entries(classifier_names=["emotion"])
+    assert analyzed_texts(classifiers["emotion"]) == []
+    assert store.segment_path(store.segments()[-1]).stat().st_size == size
+
+    with pytest.raises(ValueError):
+        analyze_entries(classifier_names=["emotion"], workers=2)
+
+
+def test_analyze_corpus_shares_chunks():
+    classifiers = {
+        "emotion": make_classifier("joy"),
+        "context": make_classifier("work"),
+    }
+    for classifier in classifiers.values():
+        classifier.chunk_key = "roberta"
+        classifier.chunk_many.side_effect = lambda texts: [[t] for t in texts]
+        classifier.classify_chunked.side_effect = classifier.classify_many.side_effect
+    entries = [{"text": "one"}, {"text": "two", "analysis": {"emotion": "sad"}}]
+
+    analyze_corpus(entries, ["emotion", "context"], classifiers=classifiers)
+
+    classifiers["emotion"].chunk_many.assert_called_once_with(["one", "two"])
+    classifiers["context"].chunk_many.assert_not_called()
+    classifiers["emotion"].classify_chunked.assert_called_once_with(
+        [["one"]], batch_size=None
+    )
+    classifiers["context"].classify_chunked.assert_called_once_with(
+        [["one"], ["two"]], batch_size=None
+    )
+    assert entries[0]["analysis"] == {"emotion": "joy", "context": "work"}
+    assert entries[1]["analysis"] == {"emotion": "sad", "context": "work"}
@@ -0,0 +1,132 @@
+import datetime
+import json
+
+import pytest
+
+from thought_log import entry_index
+from thought_log.entry_index import EntryIndex, get_index, parse_filename
+from thought_log.importer import filesystem
+from thought_log.layout import signature
+from thought_log.utils import list_entries, to_zkid
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(filesystem, "STORAGE_DIR", tmp_path)
+    monkeypatch.setattr(entry_index, "_indexes", {})
+    tmp_path.joinpath("20220101000000.UUID1.hash1.json").write_text("{}")
+    yield tmp_path
+
+
+def test_parse_filename():
+    assert parse_filename("20220101000000.UUID1.hash1.json") == (
+        20220101000000,
+        "UUID1",
+        "hash1",
+    )
+    assert parse_filename("notes.json") is None
+    assert parse_filename("analysis.json.tmp") is None
+
+
+def test_rebuilds_when_directory_changes(storage_dir):
+    index = EntryIndex(storage_dir)
+
+    assert index.count() == 1
+    assert index.find(_hash="hash1") == [
+        storage_dir / "20220101000000.UUID1.hash1.json"
+    ]
+    index.close()
+
+    # Added behind the index's back
+    storage_dir.joinpath("20220102000000.UUID2.hash2.json").write_text("{}")
+
+    assert EntryIndex(storage_dir).find(uuid="UUID2")
+
+
+def test_adding_is_transactional(storage_dir):
+    index = get_index(storage_dir)
+    filepath = storage_dir / "20220103000000.UUID3.hash3.json"
+
+    with pytest.raises(OSError):
+        with index.adding(filepath):
+            raise OSError("disk full")
+
+    assert index.find(_hash="hash3") == []
+
+    with index.adding(filepath):
+        filepath.write_text("{}")
+
+    assert index.find(_hash="hash3") == [filepath]
+    # The directory changed through the index, so reopening does not rebuild
+    assert EntryIndex(storage_dir).get_meta("dir_mtime") == signature(storage_dir)
+
+
+def test_import_dedup(storage_dir):
+    data = filesystem.prepare_data({"text": "Hello", "uuid": "UUID4"}, "hash4")
+    filesystem.import_data(data)
+
+    assert filesystem.already_imported("hash4", None)
+    assert filesystem.already_imported(None, "UUID4")
+    assert filesystem.already_imported("hash1", None)
+    assert not filesystem.already_imported("hash5", "UUID5")
+    [filepath] = storage_dir.glob("*.UUID4.hash4.json")
+    assert json.loads(filepath.read_text())["text"] == "Hello"
+
+
+@pytest.fixture
+def catalog(storage_dir):
+    for day in [3, 5, 7, 9]:
+        name = f"202201{day:02d}120000.UUID{day}.hash{day}.json"
+        storage_dir.joinpath(name).write_text("{}")
+    yield get_index(storage_dir)
+
+
+@pytest.mark.parametrize(
+    "kwargs,expected",
+    [
+        ({}, [1, 3, 5, 7, 9]),
+        ({"reverse": True, "limit": 2}, [9, 7]),
+        ({"limit": 2}, [1, 3]),
+        ({"since": 20220104000000}, [5, 7, 9]),
+        ({"since": 20220104000000, "until": 20220107120000}, [5, 7]),
+        ({"until": 20220106000000, "reverse": True, "limit": 1}, [5]),
+        ({"since": 20220110000000}, []),
+    ],
+)
+def test_zkid_range(catalog, kwargs, expected):
+    days = [int(str(zkid)[6:8]) for zkid in catalog.zkid_range(**kwargs)]
+    assert days == expected
+
+
+def test_adding_keeps_catalog_sorted(catalog, storage_dir):
+    assert catalog.zkids()[-1] == 20220109120000
+    filepath = storage_dir / "20220104000000.UUID4.hash4.json"
+
+    with catalog.adding(filepath):
+        filepath.write_text("{}")
+
+    assert catalog.zkids() == sorted(catalog.zkids())
+    assert 20220104000000 in catalog.zkids()
+    assert catalog.filepaths(20220104000000) == [filepath]
+
+
+def test_sees_entries_added_by_another_process(storage_dir):
+    ours, theirs = EntryIndex(storage_dir), EntryIndex(storage_dir)
+    assert ours.zkid_range() == [20220101000000]
+    filepath = storage_dir / "20220102000000.UUID2.hash2.json"
+
+    with theirs.adding(filepath):
+        filepath.write_text("{}")
+
+    assert ours.zkid_range() == [20220101000000, 20220102000000]
+    ours.close()
+    theirs.close()
+
+
+def test_list_entries_dates(catalog, storage_dir):
+    zkids = list_entries(
+        storage_dir, since=datetime.date(2022, 1, 5), until=datetime.date(2022, 1, 7)
+    )
+
+    assert zkids == [20220105120000, 20220107120000]
+    assert to_zkid(datetime.datetime(2022, 1, 7, 8, 30), end=True) == 20220107083000
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from thought_log import entry_index
+from thought_log.entry_index import get_index
+from thought_log.importer import filesystem
+from thought_log.layout import entry_relpath, migrate, recompress
+from thought_log.utils import detect_compression, read_json
+from thought_log.utils import list_entries
+
+NAMES = [
+    "20211231235959.UUID1.hash1.json",
+    "20220115120000.UUID2.hash2.json",
+    "20220203080000.UUID3.hash3.json",
+]
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(filesystem, "STORAGE_DIR", tmp_path)
+    monkeypatch.setattr(entry_index, "_indexes", {})
+
+    for name in NAMES:
+        tmp_path.joinpath(name).write_text(json.dumps({"text": name}))
+
+    yield tmp_path
+
+
+def test_entry_relpath():
+    assert str(entry_relpath(NAMES[1])) == NAMES[1]
+    assert str(entry_relpath(NAMES[1], "monthly")) == f"2022/01/{NAMES[1]}"
+    with pytest.raises(ValueError):
+        entry_relpath(NAMES[1], "daily")
+
+
+def test_migrate_and_back(storage_dir):
+    assert migrate(storage_dir, "monthly") == 3
+    assert storage_dir.joinpath("2021", "12", NAMES[0]).exists()
+    assert storage_dir.joinpath("2022", "02", NAMES[2]).exists()
+    assert not list(storage_dir.glob("*.json"))
+    # Reads resolve the shards
+    index = get_index(storage_dir)
+    assert index.filepaths(20220115120000) == [storage_dir / "2022" / "01" / NAMES[1]]
+    assert len(list_entries(storage_dir)) == 3
+    assert filesystem.already_imported("hash3", None)
+
+    # Nothing left to move
+    assert migrate(storage_dir, "monthly") == 0
+
+    assert migrate(storage_dir, "flat") == 3
+    assert sorted(p.name for p in storage_dir.glob("*.json")) == NAMES
+    assert not storage_dir.joinpath("2022").exists()
+
+
+def test_migrate_resumes(storage_dir, monkeypatch):
+    get_index(storage_dir)
+    # As if a previous run died after renaming one file, before indexing it
+    monkeypatch.setattr(entry_index, "_indexes", {})
+    shard = storage_dir.joinpath("2022", "01")
+    shard.mkdir(parents=True)
+    storage_dir.joinpath(NAMES[1]).rename(shard / NAMES[1])
+
+    assert migrate(storage_dir, "monthly") == 2
+    assert len(list(storage_dir.glob("*/*/*.json"))) == 3
+
+
+def test_import_into_shards(storage_dir, monkeypatch):
+    monkeypatch.setattr(filesystem, "STORAGE_LAYOUT", "monthly")
+    data = filesystem.prepare_data({"text": "Hi", "uuid": "UUID4"}, "hash4")
+    data["date"] = "2022-03-04T05:06:07"
+    filesystem.import_data(data)
+
+    [filepath] = storage_dir.glob("2022/03/*.UUID4.hash4.json")
+    assert get_index(storage_dir).find(uuid="UUID4") == [filepath]
+
+
+def test_recompress(storage_dir, monkeypatch):
+    assert recompress(storage_dir, "gzip") == 3
+    assert recompress(storage_dir, "gzip") == 0
+    filepath = storage_dir.joinpath(NAMES[0])
+    assert detect_compression(filepath.read_bytes()) == "gzip"
+    assert read_json(filepath) == {"text": NAMES[0]}
+
+    # New imports follow the setting, reads handle the mix
+    monkeypatch.setattr(filesystem, "STORAGE_COMPRESSION", "lzma")
+    data = filesystem.prepare_data({"text": "Hi", "uuid": "UUID4"}, "hash4")
+    filesystem.import_data(data)
+    [filepath] = storage_dir.glob("*.UUID4.hash4.json")
+    assert detect_compression(filepath.read_bytes()) == "lzma"
+
+    assert recompress(storage_dir, None) == 4
+    assert json.loads(filepath.read_text())["text"] == "Hi"
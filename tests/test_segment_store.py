@@ -0,0 +1,178 @@
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from thought_log import entry_index, segments
+from thought_log.importer import filesystem
+from thought_log.segments import SegmentStore, pack
+from thought_log.utils import list_entries
+
+
+def make_entry(zkid, uuid, text="hello"):
+    return {"id": zkid, "uuid": uuid, "_hash": f"hash-{uuid}", "text": text}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SegmentStore(tmp_path, segment_size=200)
+    yield store
+    store.close()
+
+
+def test_put_and_read(store):
+    store.put_many([make_entry(3, "c"), make_entry(1, "a"), make_entry(1, "b")])
+
+    assert store.get("a")["uuid"] == "a"
+    assert store.get("missing") is None
+    assert [e["uuid"] for e in store.find(1)] == ["a", "b"]
+    assert [e["uuid"] for e in store.read_many([3, 1])] == ["c", "a", "b"]
+    assert store.zkid_range() == [1, 3]
+    assert store.zkid_range(since=2) == [3]
+    assert store.zkid_range(reverse=True, limit=1) == [3]
+    assert store.exists(_hash="hash-b")
+    assert not store.exists(_hash="hash-z", uuid="z")
+
+
+def test_segments_roll_over(store):
+    store.put_many([make_entry(i, str(i), text="x" * 50) for i in range(10)])
+
+    assert len(store.segments()) > 1
+    assert all(store.segment_path(s).stat().st_size <= 200 for s in store.segments())
+    assert [e["id"] for e in store.read_many(list(range(10)))] == list(range(10))
+
+
+def test_update_appends_new_version(store):
+    store.put(make_entry(1, "a"))
+    store.put(dict(make_entry(1, "a"), analysis={"emotion": ["joyful"]}))
+
+    assert store.count() == 1
+    assert store.get("a")["analysis"] == {"emotion": ["joyful"]}
+    assert store.garbage_ratio() > 0.3
+
+
+def test_compact(store):
+    for i in range(5):
+        store.put(make_entry(1, "a", text=f"version {i}"))
+    store.put(make_entry(0, "b"))
+
+    assert store.compact() > 0
+    assert store.garbage_ratio() == 0
+    assert store.get("a")["text"] == "version 4"
+    # Rewritten in zkid order
+    lines = store.segment_path(store.segments()[0]).read_text().splitlines()
+    assert [json.loads(line)["uuid"] for line in lines] == ["b", "a"]
+
+
+def test_rebuild_and_recover(tmp_path, store):
+    store.put(make_entry(1, "a", text="old"))
+    store.put(make_entry(1, "a", text="new"))
+    assert store.rebuild() == 1
+    assert store.get("a")["text"] == "new"
+
+    # Appended without reaching the index, then a torn write
+    with open(store.segment_path(store.segments()[-1]), "ab") as f:
+        f.write(segments.dumps(make_entry(2, "b")))
+        f.write(b'{"id": 3, "uu')
+
+    reopened = SegmentStore(tmp_path, segment_size=200)
+    assert reopened.get("b")["id"] == 2
+    assert reopened.count() == 2
+
+    # The torn line is gone, so later appends stay readable
+    reopened.put(make_entry(4, "c"))
+    assert reopened.rebuild() == 3
+    reopened.close()
+
+    reopened = SegmentStore(tmp_path, segment_size=200)
+    assert reopened.get("c")["id"] == 4
+    reopened.close()
+
+
+def test_failed_rebuild_keeps_index(store):
+    store.put(make_entry(1, "a"))
+
+    with open(store.segment_path(store.segments()[-1]), "ab") as f:
+        f.write(b"not json\n")
+
+    with pytest.raises(json.JSONDecodeError):
+        store.rebuild()
+
+    assert store.count() == 1
+    assert store.get("a")["uuid"] == "a"
+
+
+def test_concurrent_writers(tmp_path):
+    def write(name):
+        store = SegmentStore(tmp_path, segment_size=2000)
+        for i in range(300):
+            store.put(make_entry(i, f"{name}{i}", text=name * i))
+        store.close()
+
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=write, args=(n,)) for n in "ab"]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    store = SegmentStore(tmp_path, segment_size=2000)
+    assert store.count() == 600
+    assert store.get("a299")["text"] == "a" * 299
+    assert store.get("b42")["text"] == "b" * 42
+    assert store.rebuild() == 600
+    store.close()
+
+
+def test_appends_hold_the_write_lock(tmp_path, store, monkeypatch):
+    other = SegmentStore(tmp_path, segment_size=200)
+    other.connection.execute("PRAGMA busy_timeout = 50")
+    dumps, blocked = segments.dumps, []
+
+    def dumps_while_other_writes(entry):
+        # Another writer showing up in the middle of this append
+        try:
+            other.put(make_entry(2, "b"))
+        except sqlite3.OperationalError:
+            blocked.append(entry["uuid"])
+        return dumps(entry)
+
+    monkeypatch.setattr(segments, "dumps", dumps_while_other_writes)
+    store.put(make_entry(1, "a"))
+    monkeypatch.setattr(segments, "dumps", dumps)
+
+    assert blocked == ["a"]
+    other.put(make_entry(2, "b"))
+    assert store.get("b")["id"] == 2
+    assert SegmentStore(tmp_path, segment_size=200).count() == 2
+    other.close()
+
+
+@pytest.fixture
+def segment_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(filesystem, "STORAGE_DIR", tmp_path)
+    monkeypatch.setattr(filesystem, "STORAGE_ENGINE", "segments")
+    monkeypatch.setattr("thought_log.config.STORAGE_ENGINE", "segments")
+    monkeypatch.setattr(entry_index, "_indexes", {})
+    monkeypatch.setattr(segments, "_stores", {})
+    yield tmp_path
+
+
+def test_import_into_segments(segment_storage):
+    data = filesystem.prepare_data({"text": "hello", "date": "2022-01-02"}, "h1")
+    filesystem.import_data(data)
+
+    assert not list(segment_storage.glob("*.json"))
+    assert filesystem.already_imported("h1", None)
+    assert list_entries(segment_storage) == [20220102000000]
+
+
+def test_pack(segment_storage):
+    name = "20220102000000.UUID1.hash1.json"
+    segment_storage.joinpath(name).write_text(json.dumps({"text": "hello"}))
+
+    assert pack(segment_storage) == 1
+    assert pack(segment_storage) == 0
+    entry = segments.get_store(segment_storage).get("UUID1")
+    assert entry == {"text": "hello", "id": 20220102000000, "uuid": "UUID1"}
@@ -0,0 +1,210 @@
+import pytest
+from pymongo import IndexModel, InsertOne, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from thought_log import storage as storage_module
+from thought_log.models import Note, Notebook, ensure_indexes
+from thought_log.sqlite_storage import (
+    Insert,
+    Replace,
+    SQLiteDatabase,
+    apply_update,
+    build_where,
+)
+from thought_log.storage import Storage
+
+
+@pytest.fixture
+def db():
+    database = SQLiteDatabase(":memory:")
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    _store = Storage(backend="sqlite", url=":memory:")
+    monkeypatch.setattr(storage_module, "storage", _store)
+    yield _store
+
+
+def test_build_where():
+    assert build_where({"id": 1}) == ("json_extract(doc, '$.id') IS ?", [1])
+    assert build_where({"$or": [{"a": {"$gt": 1}}, {"b": {"$in": [2, 3]}}]}) == (
+        "(json_extract(doc, '$.a') > ? OR json_extract(doc, '$.b') IN (?, ?))",
+        [1, 2, 3],
+    )
+
+    with pytest.raises(ValueError):
+        build_where({"id) OR 1=1 --": 1})
+
+
+def test_apply_update():
+    doc = {"id": 1, "seq": 5}
+
+    assert apply_update(doc, {"$inc": {"seq": 2}, "$set": {"a.b": 1}}) == {
+        "id": 1,
+        "seq": 7,
+        "a": {"b": 1},
+    }
+    assert apply_update(doc, {"$max": {"seq": 3}})["seq"] == 5
+    assert apply_update(doc, {"$setOnInsert": {"x": 1}}) == doc
+    assert apply_update({}, {"$setOnInsert": {"x": 1}}, is_insert=True) == {"x": 1}
+
+
+def test_find(db):
+    notes = db["notes"]
+    for i in range(5):
+        notes.insert_one({"id": i, "notebook": i % 2, "title": f"Note {i}"})
+
+    found = notes.find({"notebook": 1}, {"title": 1, "_id": 0}, sort=[("id", -1)])
+    assert list(found) == [{"title": "Note 3"}, {"title": "Note 1"}]
+    assert notes.find_one({"id": {"$gte": 3}})["id"] == 3
+    assert [n["id"] for n in notes.find().sort("$natural", -1).limit(2)] == [4, 3]
+
+
+def test_find_one_and_update_upsert(db):
+    counters = db["counters"]
+    update = {"$inc": {"seq": 1}}
+
+    assert counters.find_one_and_update({"_id": "notes.id"}, update) is None
+    first = counters.find_one_and_update(
+        {"_id": "notes.id"}, update, upsert=True, return_document=True
+    )
+    second = counters.find_one_and_update(
+        {"_id": "notes.id"}, update, return_document=True
+    )
+
+    assert (first["seq"], second["seq"]) == (1, 2)
+
+
+def test_bulk_write(db):
+    notes = db["notes"]
+    requests = [
+        Insert({"id": 1, "title": "A"}),
+        Replace({"id": 1}, {"id": 1, "title": "A2"}),
+        Replace({"id": 2}, {"id": 2, "title": "B"}, upsert=True),
+    ]
+
+    # Plain pymongo requests to MongoDB
+    assert all(isinstance(r, (InsertOne, ReplaceOne)) for r in requests)
+    notes.bulk_write(requests)
+    assert [n["title"] for n in notes.find(sort=[("id", 1)])] == ["A2", "B"]
+
+    with pytest.raises(NotImplementedError):
+        notes.bulk_write([InsertOne({"id": 3})])
+
+
+def test_indexes(db):
+    notes = db["notes"]
+    notes.create_indexes([IndexModel("id", unique=True)])
+    notes.insert_one({"id": 1})
+
+    plan = notes.find({"id": 1}).explain()["queryPlanner"]["winningPlan"]
+    assert plan["inputStage"]["stage"] == "IXSCAN"
+
+    with pytest.raises(DuplicateKeyError):
+        notes.insert_one({"id": 1})
+
+
+def test_lookup(db):
+    db["notebooks"].insert_one({"id": 1})
+    db["notes"].insert_one({"id": 1, "notebook": 1})
+    db["notes"].insert_one({"id": 2, "notebook": 2})
+
+    results = list(
+        db["notebooks"].aggregate(
+            [
+                {"$match": {"id": 1}},
+                {
+                    "$lookup": {
+                        "from": "notes",
+                        "localField": "id",
+                        "foreignField": "notebook",
+                        "as": "joinedResult",
+                    }
+                },
+            ]
+        )
+    )
+
+    assert [n["id"] for n in results[0]["joinedResult"]] == [1]
+
+
+def test_models(store):
+    ensure_indexes()
+
+    notebook = Notebook.insert({"title": "Journal"})
+    Note.upsert([{"title": "A", "notebook": notebook.id}, {"title": "B"}])
+    note = Note.update({"id": 2, "notebook": notebook.id})
+    records, next_cursor = Note.find_page(limit=1)
+
+    assert note.title == "B"
+    assert [n.title for n in Notebook.find_one({"id": 1}).notes()] == ["A", "B"]
+    assert [n.id for n in records] == [1]
+    assert [n.id for n in Note.find_page(limit=1, after=next_cursor)[0]] == [2]
+    assert store.query_plan("notes", {"notebook": 1})[-1] == "IXSCAN"
+
+
+def test_models_bulk_errors(store):
+    ensure_indexes()
+    Note.upsert([{"title": "A"}])
+
+    results = Note.upsert(
+        [{"title": "B"}, {"id": 1, "title": "A2"}, {"title": "C"}], ordered=False
+    )
+
+    assert [r["status"] for r in results] == ["inserted", "updated", "inserted"]
+    assert Note.find_one({"id": 1}).title == "A2"
+    assert len(Note.find()) == 3
+
+    # Items are only ever inserted by bulk_write, so clashes surface as errors
+    store.db["counters"].find_one_and_update({"_id": "notes.id"}, {"$set": {"seq": 0}})
+    results = Note.upsert([{"title": "D"}], ordered=False)
+    assert results[0]["status"] == "error"
+
+
+def test_unique_index_over_duplicates(store):
+    for document in [{"id": 1}, {"id": 1}]:
+        store.db["notes"].insert_one(document)
+
+    with pytest.raises(DuplicateKeyError):
+        ensure_indexes()
+
+
+def test_insert_never_returns_another_document(store):
+    ensure_indexes()
+    Note.insert({"title": "A"})
+    # Written around the counter
+    store.db["notes"].insert_one({"id": 2, "title": "B"})
+
+    with pytest.raises(DuplicateKeyError):
+        Note.insert({"title": "C"})
+
+    assert Note.find_one({"id": 2}).title == "B"
+
+
+def test_explicit_ids_raise_the_counter(store):
+    ensure_indexes()
+    Note.insert({"title": "A"})
+
+    assert Note.save_returning({"id": 5, "title": "B"}).id == 5
+    assert Note.insert({"title": "C"}).id == 6
+
+    Note.upsert([{"id": 9, "title": "D"}, {"title": "E"}, {"id": 8, "title": "F"}])
+    assert Note.insert({"title": "G"}).id == 10
+
+    Note.insert({"id": 20, "title": "H"})
+    assert Note.save_returning({"title": "I"}).id == 21
+
+
+def test_embed_limit_reads_only_the_limit(store):
+    ensure_indexes()
+    notebooks = [Notebook.insert({"title": t}) for t in ("A", "B")]
+    Note.upsert([{"title": f"N{i}", "notebook": 1} for i in range(5)])
+
+    Notebook.embed_children(notebooks, "notes", limit=2)
+
+    embedded = [nb.to_dict(embed="notes")["notes"] for nb in notebooks]
+    assert [[n["title"] for n in notes] for notes in embedded] == [["N0", "N1"], []]
+    assert store.query_plan("notes", {"notebook": 1})[-1] == "IXSCAN"
@@ -0,0 +1,258 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from thought_log import storage as storage_module
+from thought_log.models import Note, Notebook
+from thought_log.sqlite_storage import Insert, Replace
+from thought_log.storage import Storage, decode_cursor, encode_cursor, keyset_params
+
+
+@pytest.fixture
+def store():
+    collections = {}
+    _store = Storage()
+    _store._client = MagicMock()
+    _store._db = MagicMock()
+    _store._pid = os.getpid()
+    _store._db.__getitem__.side_effect = lambda name: collections.setdefault(
+        name, MagicMock()
+    )
+    _store.db[
+        "counters"
+    ].find_one_and_update.side_effect = lambda find_obj, update, **kwargs: {
+        "seq": 10 + update["$inc"]["seq"]
+    }
+    yield _store
+
+
+def test_upsert_many(store):
+    collection = store.db["notes"]
+    collection.find.return_value = [{"id": 3, "title": "Old", "text": "Old"}]
+
+    results = store.upsert_many(
+        "notes",
+        [{"title": "A"}, {"id": 3, "title": "New"}, {"title": "B"}],
+        identifier_keys=["id"],
+        autoincrement="id",
+    )
+
+    collection.find.assert_called_once_with({"id": {"$in": [3]}})
+    store.db["counters"].find_one_and_update.assert_called_once()
+    operations = collection.bulk_write.call_args[0][0]
+    assert [type(op) for op in operations] == [Insert, Replace, Insert]
+    assert [(r["id"], r["status"]) for r in results] == [
+        (11, "inserted"),
+        (3, "updated"),
+        (12, "inserted"),
+    ]
+
+
+def test_upsert_many_errors(store):
+    collection = store.db["notes"]
+    collection.find.return_value = []
+    collection.bulk_write.side_effect = BulkWriteError(
+        {"writeErrors": [{"index": 1, "errmsg": "duplicate key"}]}
+    )
+
+    results = store.upsert_many(
+        "notes", [{"title": "A"}, {"title": "B"}, {"title": "C"}], autoincrement="id"
+    )
+
+    assert [r["status"] for r in results] == ["inserted", "error", "skipped"]
+    assert results[1]["error"] == "duplicate key"
+
+
+def test_get_next_sequence_reserves_block(store):
+    assert store.get_next_sequence("notes", "id", count=5) == 11
+    store.db["counters"].find_one_and_update.assert_called_once_with(
+        {"_id": "notes.id"}, {"$inc": {"seq": 5}}, return_document=True
+    )
+
+
+def test_get_next_sequence_seeds_missing_counter(store):
+    counters = {}
+
+    def find_one_and_update(find_obj, update, **kwargs):
+        key = find_obj["_id"]
+        if "$max" in update:
+            counters[key] = max(counters.get(key, 0), update["$max"]["seq"])
+        elif key in counters:
+            counters[key] += update["$inc"]["seq"]
+        else:
+            return None
+        return {"_id": key, "seq": counters[key]}
+
+    store.db["counters"].find_one_and_update.side_effect = find_one_and_update
+    store.db["notes"].find_one.return_value = {"id": 41}
+
+    assert store.get_next_sequence("notes", "id") == 42
+    assert store.get_next_sequence("notes", "id", count=3) == 43
+    assert counters == {"notes.id": 45}
+
+
+def test_ensure_indexes(store):
+    store.ensure_indexes("notes", [("id", {"unique": True}), ("uuid", {})])
+
+    indexes = store.db["notes"].create_indexes.call_args[0][0]
+    assert [index.document["key"] for index in indexes] == [{"id": 1}, {"uuid": 1}]
+    assert indexes[0].document["unique"] is True
+
+
+def test_query_plan(store):
+    store.db["notes"].find.return_value.explain.return_value = {
+        "queryPlanner": {
+            "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+        }
+    }
+
+    assert store.query_plan("notes", {"id": 1}) == ["FETCH", "IXSCAN"]
+
+
+def test_keyset_params():
+    assert keyset_params(["id"], [5]) == {"id": {"$gt": 5}}
+    assert keyset_params(["created", "id"], [100, 5], "DESC") == {
+        "$or": [{"created": {"$lt": 100}}, {"created": 100, "id": {"$lt": 5}}]
+    }
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor([100, 5])) == [100, 5]
+
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_find_page(store, monkeypatch):
+    monkeypatch.setattr(storage_module, "storage", store)
+    store.db["notes"].find.return_value = [
+        {"id": 7, "created": 300, "title": "A"},
+        {"id": 6, "created": 200, "title": "B"},
+        {"id": 5, "created": 200, "title": "C"},
+    ]
+
+    records, next_cursor = Note.find_page(
+        limit=2, after=encode_cursor([400, 8]), sort="-created", fields=["title"]
+    )
+
+    params, projection = store.db["notes"].find.call_args[0]
+    kwargs = store.db["notes"].find.call_args[1]
+    assert params == keyset_params(["created", "id"], [400, 8], "DESC")
+    assert projection == {"title": 1, "created": 1, "id": 1, "_id": 0}
+    assert kwargs == {"sort": [("created", -1), ("id", -1)], "limit": 3}
+    assert [r.id for r in records] == [7, 6]
+    assert decode_cursor(next_cursor) == [200, 6]
+
+
+def test_find_page_rejects_unknown_fields(store, monkeypatch):
+    monkeypatch.setattr(storage_module, "storage", store)
+
+    with pytest.raises(ValueError):
+        Note.find_page(limit=10, fields=["secret"])
+
+
+def test_stream(store, monkeypatch):
+    monkeypatch.setattr(storage_module, "storage", store)
+    store.db["notes"].find.return_value = iter([{"id": 1}, {"id": 2}])
+
+    records = Note.stream(fields=["title"], batch_size=50)
+
+    assert not store.db["notes"].find.called
+    assert [r.id for r in records] == [1, 2]
+    assert store.db["notes"].find.call_args[1] == {
+        "sort": [("id", 1)],
+        "batch_size": 50,
+    }
+
+
+def test_embed_children(store, monkeypatch):
+    monkeypatch.setattr(storage_module, "storage", store)
+    store.db["notes"].find.return_value = [
+        {"id": 1, "notebook": 1, "title": "A"},
+        {"id": 2, "notebook": 1, "title": "B"},
+        {"id": 3, "notebook": 2, "title": "C"},
+    ]
+    notebooks = [Notebook({"id": 1}), Notebook({"id": 2}), Notebook({"id": 3})]
+
+    Notebook.embed_children(notebooks, "notes", fields=["title"])
+
+    store.db["notes"].find.assert_called_once_with(
+        {"notebook": {"$in": [1, 2, 3]}},
+        {"title": 1, "notebook": 1, "_id": 0},
+        sort=[("notebook", 1), ("id", 1)],
+    )
+    assert [n.to_dict(embed="notes") for n in notebooks] == [
+        {
+            "id": 1,
+            "notes": [
+                {"id": 1, "notebook": 1, "title": "A"},
+                {"id": 2, "notebook": 1, "title": "B"},
+            ],
+        },
+        {"id": 2, "notes": [{"id": 3, "notebook": 2, "title": "C"}]},
+        {"id": 3, "notes": []},
+    ]
+
+
+def test_embed_children_limit(store, monkeypatch):
+    monkeypatch.setattr(storage_module, "storage", store)
+    store.db["notes"].find.return_value = [{"id": 1, "notebook": 1, "title": "A"}]
+    notebooks = [Notebook({"id": 1}), Notebook({"id": 2})]
+
+    Notebook.embed_children(notebooks, "notes", limit=1, fields=["title"])
+
+    # Limited on the server, one query per parent
+    assert store.db["notes"].find.call_args_list == [
+        (
+            ({"notebook": i}, {"title": 1, "notebook": 1, "_id": 0}),
+            {"sort": [("id", 1)], "limit": 1},
+        )
+        for i in (1, 2)
+    ]
+
+
+def test_embed_children_rejects_unknown_relation():
+    with pytest.raises(ValueError):
+        Notebook.embed_children([], "notebooks")
+
+
+def test_update_returning(store):
+    store.db["notes"].find_one_and_update.return_value = {"id": 3, "title": "New"}
+
+    result = store.update_returning("notes", {"id": 3}, {"id": 3, "title": "New"})
+
+    find_obj, update = store.db["notes"].find_one_and_update.call_args[0]
+    assert find_obj == {"id": 3}
+    assert set(update) == {"$set"}
+    assert update["$set"]["title"] == "New"
+    assert "edited" in update["$set"]
+    assert result == {"id": 3, "title": "New"}
+
+
+def test_save_returning_inserts_new(store, monkeypatch):
+    monkeypatch.setattr(storage_module, "storage", store)
+
+    note = Note.save_returning({"title": "Hello"})
+
+    [inserted] = store.db["notes"].insert_one.call_args[0]
+    assert inserted["id"] == 11
+    assert note.id == 11
+    assert note.title == "Hello"
+    assert note.created
+
+
+def test_storage_connects_lazily():
+    with patch.object(storage_module, "MongoClient") as client:
+        store = Storage(url="mongodb://localhost")
+        assert not client.called
+
+        store.db
+        store.db
+        assert client.call_count == 1
+
+        # A forked child gets its own client
+        store._pid = -1
+        store.db
+        assert client.call_count == 2
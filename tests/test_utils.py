@@ -5,7 +5,7 @@ from unittest.mock import Mock
 import pytest
 from appdirs import user_cache_dir, user_config_dir, user_data_dir
 
-from thought_log.utils import common, paths
+from thought_log.utils import common, io, paths
 
 APP_NAME = "ThoughtLog"
 APP_AUTHOR = "SolipsisAI"
@@ -109,3 +109,18 @@ def test_make_datetime():
 
     datetime_obj = "2018-01-01"
     assert common.make_datetime(datetime_obj) == datetime(2018, 1, 1, 0, 0)
+
+
+@pytest.mark.parametrize("compression", [None, *io.COMPRESSIONS])
+def test_json_compression(tmp_path, compression):
+    filepath = tmp_path.joinpath("entry.json")
+    data = {"text": "hello " * 100, "date": date(2022, 9, 10)}
+    io.write_json(data, filepath, compression=compression)
+
+    assert io.detect_compression(filepath.read_bytes()) == compression
+    assert io.read_json(filepath) == {**data, "date": "2022-09-10"}
+
+
+def test_write_json_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        io.write_json({}, tmp_path.joinpath("entry.json"), compression="rar")